@@ -1,69 +1,569 @@
 
 import random
+import time
 import Chess_engine
 
-# Chess.com-style scoring
-pieceScore = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
-
-knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
-                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
-                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
-                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
-                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
-                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
-                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
-                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
-
-bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
-                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
-                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
-                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
-                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
-                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
-                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
-
-rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
-               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
-               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
-
-queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
-                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
-                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
-                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
-                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
-
-pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
-               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
-               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
-               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
-               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
-               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
-               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
-               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
-
-piece_position_scores = {"wN": knight_scores,
-                         "bN": knight_scores[::-1],
-                         "wB": bishop_scores,
-                         "bB": bishop_scores[::-1],
-                         "wQ": queen_scores,
-                         "bQ": queen_scores[::-1],
-                         "wR": rook_scores,
-                         "bR": rook_scores[::-1],
-                         "wp": pawn_scores,
-                         "bp": pawn_scores[::-1]}
+# Chess.com-style scoring, the tables live in Chess_engine so GameState can keep the score up to date
+from Chess_engine import pieceScore, knight_scores, bishop_scores, rook_scores, queen_scores, pawn_scores, \
+    piece_position_scores
 
 CHECKMATE = 1000
 STALEMATE = 0
-DEPTH = 3
+DEPTH = 3  # fixed depth of the plain minimax/negamax searches
+
+# Iterative deepening limits for findBestMove
+TIME_LIMIT = 2.0  # seconds per move
+NODE_LIMIT = None  # nodes per move, None for no limit
+MAX_DEPTH = 64
+ROOT_SPLIT_WORKERS = 1  # processes findBestMove splits the root moves over, 1 searches in this process
+CHECK_EVERY = 256  # nodes between two clock reads
+SEARCH_STATS = False  # count table probes and hits and print a summary after every search, see SearchStats
+
+# Transposition table
+TT_SIZE = 1 << 16  # number of slots, must be a power of two
+EXACT = 0  # score is the exact value of the position
+LOWERBOUND = 1  # search failed high, the real score is at least this
+UPPERBOUND = 2  # search failed low, the real score is at most this
+
+
+class TranspositionTable():
+    """
+    Fixed-size table of search results indexed by the low bits of the position key.
+    Each slot holds one (key, depth, score, flag, moveID, generation) entry. A slot is only
+    overwritten by a search at least as deep, or when its entry is left over from an earlier
+    call to findBestMove, so the table never grows past TT_SIZE entries.
+    """
+    def __init__(self, size=TT_SIZE):
+        self.size = size
+        self.mask = size - 1
+        self.entries = [None] * size
+        self.generation = 0
+
+    def newSearch(self):
+        self.generation += 1
+
+    def clear(self):
+        self.entries = [None] * self.size
+        self.generation = 0
+
+    def probe(self, key):
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry[0] == key:
+            return entry
+        return None
+
+    def store(self, key, depth, score, flag, move):
+        index = key & self.mask
+        entry = self.entries[index]
+        if entry is None or entry[5] != self.generation or depth >= entry[1]:
+            self.entries[index] = (key, depth, score, flag, move.moveID if move is not None else None, self.generation)
+
+
+class SharedTranspositionTable():
+    """
+    Transposition table in a shared array of 64-bit words, so several processes can search with the same table
+    (see Chess_smp). Word 0 holds the generation, slot i uses words 2i+2 and 2i+3 for (key ^ data, data).
+    Writes are not locked: an entry torn by two processes writing at once no longer matches its key
+    and reads as empty. data packs score in thousandths (24 bits), depth (7), flag (2), generation (8)
+    and moveID + 1 (17).
+    """
+    SCORE_OFFSET = 1 << 23
+
+    def __init__(self, words):
+        # words: a multiprocessing.RawArray("Q", 2 * size + 2)
+        self.words = memoryview(words).cast("B").cast("Q")
+        self.size = (len(self.words) - 2) // 2
+        self.mask = self.size - 1
+        self.generation = self.words[0]
+
+    def nextGeneration(self):
+        """
+        Called once per search by the process that starts it, before any process calls newSearch
+        """
+        self.words[0] = (self.words[0] + 1) & 0xFF
+
+    def newSearch(self):
+        self.generation = self.words[0]
+
+    def clear(self):
+        self.words.cast("B")[:] = bytes(len(self.words) * 8)
+        self.generation = 0
+
+    def probe(self, key):
+        index = 2 * (key & self.mask) + 2
+        data = self.words[index + 1]
+        if data == 0 or self.words[index] ^ data != key:
+            return None
+        moveID = (data >> 41) - 1
+        return (key, (data >> 24) & 0x7F, ((data & 0xFFFFFF) - self.SCORE_OFFSET) / 1000, (data >> 31) & 3,
+                moveID if moveID >= 0 else None, (data >> 33) & 0xFF)
+
+    def store(self, key, depth, score, flag, move):
+        index = 2 * (key & self.mask) + 2
+        old = self.words[index + 1]
+        if old == 0 or (old >> 33) & 0xFF != self.generation or depth >= (old >> 24) & 0x7F:
+            moveID = move.moveID if move is not None else -1
+            data = ((round(score * 1000) + self.SCORE_OFFSET) | depth << 24 | flag << 31 |
+                    self.generation << 33 | (moveID + 1) << 41)
+            self.words[index] = key ^ data
+            self.words[index + 1] = data
+
+
+class CountingTable():
+    """
+    Wraps a transposition table to count probes and hits. Only put in place for searches that collect statistics,
+    so the node loop has no extra work when they are off.
+    """
+    def __init__(self, table):
+        self.table = table
+        self.probes = 0
+        self.hits = 0
+
+    def newSearch(self):
+        self.table.newSearch()
+
+    def clear(self):
+        self.table.clear()
+
+    def probe(self, key):
+        self.probes += 1
+        entry = self.table.probe(key)
+        if entry is not None:
+            self.hits += 1
+        return entry
+
+    def store(self, key, depth, score, flag, move):
+        self.table.store(key, depth, score, flag, move)
+
+
+class SearchStats():
+    """
+    Counters of one search, returned with the move by Searcher.searchWithStats and kept in Searcher.stats.
+    ttProbes and ttHits are None unless the Searcher collects statistics.
+    """
+    def __init__(self):
+        self.depth = 0  # last completed iteration
+        self.nodes = 0
+        self.qnodes = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.ttProbes = None
+        self.ttHits = None
+        self.seconds = 0.0
+        self.iterations = []  # (depth, seconds, nodes) of every completed iteration
+
+    def totalNodes(self):
+        return self.nodes + self.qnodes
+
+    def nodesPerSecond(self):
+        return self.totalNodes() / self.seconds if self.seconds > 0 else 0.0
+
+    def firstMoveCutoffRate(self):
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs > 0 else 0.0
+
+    def ttHitRate(self):
+        return self.ttHits / self.ttProbes if self.ttProbes else 0.0
+
+    def effectiveBranchingFactor(self):
+        """
+        Nodes of the last completed iteration over those of the one before
+        """
+        if len(self.iterations) < 2 or self.iterations[-2][2] == 0:
+            return 0.0
+        return self.iterations[-1][2] / self.iterations[-2][2]
+
+    def asDict(self):
+        return {"depth": self.depth, "nodes": self.nodes, "qnodes": self.qnodes, "seconds": self.seconds,
+                "nps": self.nodesPerSecond(), "betaCutoffs": self.betaCutoffs,
+                "firstMoveCutoffRate": self.firstMoveCutoffRate(), "ttProbes": self.ttProbes, "ttHits": self.ttHits,
+                "ebf": self.effectiveBranchingFactor(), "iterations": [list(item) for item in self.iterations]}
+
+    def __str__(self):
+        text = ("depth %d, %d nodes + %d quiescence nodes in %.2fs, %.0f nodes/s, first move cutoffs %.1f%%, ebf %.2f" %
+                (self.depth, self.nodes, self.qnodes, self.seconds, self.nodesPerSecond(),
+                 100 * self.firstMoveCutoffRate(), self.effectiveBranchingFactor()))
+        if self.ttProbes is not None:
+            text += ", table hits %d/%d (%.1f%%)" % (self.ttHits, self.ttProbes, 100 * self.ttHitRate())
+        return text + "\n" + "\n".join("  depth %d: %.3fs, %d nodes" % item for item in self.iterations)
+
+
+class SearchTimeout(Exception):
+    """
+    Raised inside the search when the time or node budget of the current move has run out
+    """
+
+
+def orderHashMove(validMoves, moveID):
+    """
+    Put the move stored in the transposition table in front of the others
+    """
+    if moveID is None:
+        return validMoves
+    for i, move in enumerate(validMoves):
+        if move.moveID == moveID:
+            if i == 0:
+                return validMoves
+            return [move] + validMoves[:i] + validMoves[i + 1:]
+    return validMoves
+
+
+# Move ordering
+mvvLvaValue = {"P": 1, "N": 3, "B": 3, "R": 5, "Q": 9, "K": 10}
+HASH_MOVE_SCORE = 1000000
+CAPTURE_SCORE = 100000  # + 10 * victim - attacker
+KILLER_SCORES = (90000, 80000)
+
+
+def mvvLvaScore(move):
+    """
+    10 * value of the captured piece - value of the capturing one, plus the value of a promotion piece
+    """
+    score = 0
+    if move.isCapture:
+        score = 10 * mvvLvaValue[move.pieceCaptured[1]] - mvvLvaValue[move.pieceMoved[1]]
+    if move.promoteTo:
+        score += 10 * mvvLvaValue[move.promoteTo[1]]  # queen promotions before underpromotions
+    return score
+
+
+ROOT_TIE_MARGIN = 0.0005  # half the smallest score difference, see Searcher exactRoot
+
+
+class Searcher():
+    """
+    Everything one search needs that outlives a single node: limits, transposition table, killer and history
+    tables, counters and the result of the last search. Each Searcher is independent, so several searches
+    can run in one interpreter, e.g. one per game in a thread pool.
+    """
+    def __init__(self, timeLimit=TIME_LIMIT, maxNodes=NODE_LIMIT, maxDepth=MAX_DEPTH, ttSize=TT_SIZE, seed=None,
+                 collectStats=None, shuffle=True, exactRoot=False):
+        self.random = random.Random(seed)  # shuffles the root moves
+        self.shuffle = shuffle  # False searches the root moves in generation order, for reproducible benchmarks
+        # True for the root split search (Chess_smp.searchSplitRoot): table scores only from entries of the same
+        # depth, never deeper ones, and every root move that ties with the best one searched for its exact score,
+        # the tie going to the earliest move of the shuffled list. The result of a search to a given depth then
+        # doesn't depend on what is left in the table or on the order the root moves finish in. About 5% more nodes.
+        self.exactRoot = exactRoot
+        self.collectStats = SEARCH_STATS if collectStats is None else collectStats
+        self.stats = SearchStats()  # of the last search
+        self.timeLimit = timeLimit
+        self.maxNodes = maxNodes
+        self.maxDepth = maxDepth
+        self.transpositionTable = TranspositionTable(ttSize)
+        self.killerMoves = []  # two quiet moveIDs per ply that caused a cutoff
+        self.growKillerMoves(max(maxDepth, MAX_DEPTH))
+        self.historyTable = [[0] * 64 for _ in range(64)]  # [from square][to square], bumped by depth * depth on a cutoff
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+        self.rootDepth = DEPTH  # depth of the current iteration, the root node is searched with depth == rootDepth
+        self.rootIndex = {}  # moveID -> position of the root move in the shuffled list, breaks ties between equal root scores
+        self.nodes = 0  # nodes of the main search
+        self.qnodes = 0  # nodes of the quiescence search, horizon nodes included
+        self.deadline = None
+        self.nodeLimit = None
+        self.stopRequested = None  # function returning True once the caller wants the search stopped, or None
+        self.nextMove = None  # best root move of the current iteration
+        self.bestMove = None  # result of the last search: move, score and line of the last completed iteration
+        self.lastCompletedDepth = 0
+        self.lastScore = 0
+        self.bestLine = []
+        self.onIteration = None  # called with the Searcher after every completed iteration, to report progress
+
+    def setLimits(self, timeLimit, maxNodes, maxDepth):
+        self.timeLimit = timeLimit
+        self.maxNodes = maxNodes
+        self.maxDepth = maxDepth
+        self.growKillerMoves(maxDepth)
+
+    def growKillerMoves(self, depth):
+        """
+        Make room for killer moves down to ply depth, the deepest a search to that depth reaches
+        """
+        while len(self.killerMoves) <= depth:
+            self.killerMoves.append([None, None])
+
+    def newGame(self):
+        self.transpositionTable.clear()
+        self.resetMoveOrdering()
+
+    def resetMoveOrdering(self):
+        for killers in self.killerMoves:
+            killers[0] = killers[1] = None
+        for row in self.historyTable:
+            for i in range(64):
+                row[i] = 0
+        self.betaCutoffs = 0
+        self.firstMoveCutoffs = 0
+
+    def checkLimits(self):
+        """
+        Abort the iteration once the budget is spent. The first iteration always completes so there is a move to play.
+        """
+        if self.rootDepth > 1:
+            total = self.nodes + self.qnodes
+            if self.nodeLimit is not None and total >= self.nodeLimit:
+                raise SearchTimeout()
+            if total % CHECK_EVERY == 0:
+                if self.deadline is not None and time.time() >= self.deadline:
+                    raise SearchTimeout()
+                if self.stopRequested is not None and self.stopRequested():
+                    raise SearchTimeout()
+
+    def orderMoves(self, validMoves, ply, hashMoveID):
+        """
+        Sort the moves so the ones most likely to cause a cutoff are searched first:
+        hash move, captures by MVV-LVA (most valuable victim, least valuable attacker),
+        killer moves of this ply and finally quiet moves by their history score
+        """
+        killer1, killer2 = self.killerMoves[ply]
+        historyTable = self.historyTable
+
+        def moveScore(move):
+            moveID = move.moveID
+            if moveID == hashMoveID:
+                return HASH_MOVE_SCORE
+            if move.isCapture or move.isPawnPromotion:
+                return CAPTURE_SCORE + mvvLvaScore(move)
+            if moveID == killer1:
+                return KILLER_SCORES[0]
+            if moveID == killer2:
+                return KILLER_SCORES[1]
+            return historyTable[move.startRow * 8 + move.startCol][move.endRow * 8 + move.endCol]
+
+        return sorted(validMoves, key=moveScore, reverse=True)
+
+    def storeCutoff(self, move, ply, depth):
+        """
+        Remember a quiet move that caused a beta cutoff in the killer slots of its ply and the history table
+        """
+        killers = self.killerMoves[ply]
+        if killers[0] != move.moveID:
+            killers[1] = killers[0]
+            killers[0] = move.moveID
+        self.historyTable[move.startRow * 8 + move.startCol][move.endRow * 8 + move.endCol] += depth * depth
+
+    def firstMoveCutoffRate(self):
+        """
+        Share of beta cutoffs produced by the first move searched, the higher the better the ordering
+        """
+        return self.firstMoveCutoffs / self.betaCutoffs if self.betaCutoffs > 0 else 0.0
+
+    def search(self, gs, validMoves, stop=None, startDepth=1):
+        """
+        Iterative deepening: search depth startDepth, startDepth + 1... until the time or node budget runs out,
+        or stop() returns True, and return the best move of the last completed iteration
+        """
+        if self.shuffle:
+            self.random.shuffle(validMoves)
+        self.rootIndex = {move.moveID: i for i, move in enumerate(validMoves)}
+        self.transpositionTable.newSearch()
+        self.resetMoveOrdering()
+        self.nodes = 0
+        self.qnodes = 0
+        self.deadline = time.time() + self.timeLimit if self.timeLimit is not None else None
+        self.nodeLimit = self.maxNodes
+        self.stopRequested = stop
+        startPly = len(gs.move_log)
+        bestMove = None
+        self.bestMove = None
+        self.lastCompletedDepth = 0
+        self.lastScore = 0
+        self.bestLine = []
+        stats = SearchStats()
+        table = self.transpositionTable
+        if self.collectStats:
+            self.transpositionTable = CountingTable(table)
+        start = time.perf_counter()
+        try:
+            for depth in range(startDepth, self.maxDepth + 1):
+                self.rootDepth = depth
+                self.nextMove = None
+                iterationStart = time.perf_counter()
+                iterationNodes = self.nodes + self.qnodes
+                try:
+                    score = self.findMoveNegaMaxAlphaBeta(gs, validMoves, depth, -CHECKMATE, CHECKMATE,
+                                                         1 if gs.white_to_move else -1)
+                except SearchTimeout:
+                    # unwind the moves the interrupted iteration left on the board
+                    while len(gs.move_log) > startPly:
+                        gs.undoMove()
+                    break
+                stats.iterations.append((depth, time.perf_counter() - iterationStart,
+                                         self.nodes + self.qnodes - iterationNodes))
+                if self.nextMove is None:  # every move runs into mate, any of them will do
+                    bestMove = validMoves[0] if len(validMoves) > 0 else None
+                    self.bestMove = bestMove
+                    self.bestLine = [bestMove] if bestMove is not None else []
+                    break
+                bestMove = self.nextMove
+                self.bestMove = bestMove
+                self.lastCompletedDepth = depth
+                self.lastScore = score
+                self.bestLine = self.getPrincipalVariation(gs, bestMove, depth)
+                if self.onIteration is not None:
+                    self.onIteration(self)
+                if len(validMoves) == 1 or score >= CHECKMATE:
+                    break
+                # search the best move of this iteration first in the next one
+                validMoves = orderHashMove(validMoves, bestMove.moveID)
+        finally:
+            if self.collectStats:
+                stats.ttProbes = self.transpositionTable.probes
+                stats.ttHits = self.transpositionTable.hits
+                self.transpositionTable = table
+        stats.seconds = time.perf_counter() - start
+        stats.depth = self.lastCompletedDepth
+        stats.nodes = self.nodes
+        stats.qnodes = self.qnodes
+        stats.betaCutoffs = self.betaCutoffs
+        stats.firstMoveCutoffs = self.firstMoveCutoffs
+        self.stats = stats
+        if self.collectStats:
+            print(stats)
+        return bestMove
+
+    def searchWithStats(self, gs, validMoves, stop=None, startDepth=1):
+        """
+        Same search, returns (best move, SearchStats)
+        """
+        bestMove = self.search(gs, validMoves, stop, startDepth)
+        return bestMove, self.stats
+
+    def getPrincipalVariation(self, gs, firstMove, depth):
+        """
+        Best line from firstMove on, following the hash moves stored in the transposition table
+        """
+        line = []
+        move = firstMove
+        while move is not None and len(line) < depth:
+            line.append(move)
+            gs.makeMove(move)
+            entry = self.transpositionTable.probe(gs.zobrist_key)
+            move = None
+            if entry is not None and entry[4] is not None:
+                for nextMove in gs.getValidMoves():
+                    if nextMove.moveID == entry[4]:
+                        move = nextMove
+                        break
+        for _ in line:
+            gs.undoMove()
+        return line
+
+    def findMoveNegaMaxAlphaBeta(self, gs, validMoves, depth, alpha, beta, turnMultiplier):
+        """
+        Thuật toán Negamax với Alpha-Beta pruning
+        """
+        if depth == 0:
+            return self.quiescenceSearch(gs, alpha, beta, turnMultiplier)
+
+        self.nodes += 1
+        self.checkLimits()
+
+        if len(validMoves) == 0:  # checkmate or stalemate, getValidMoves has set the flag
+            return turnMultiplier * scoreBoard(gs)
+
+        # probe the transposition table before expanding children
+        rootDepth = self.rootDepth
+        alphaOrig = alpha
+        key = gs.zobrist_key
+        hashMoveID = None
+        entry = self.transpositionTable.probe(key)
+        if entry is not None:
+            # never cut off at the root, nextMove has to come from this search
+            if depth != rootDepth and (entry[1] == depth if self.exactRoot else entry[1] >= depth):
+                ttScore = entry[2]
+                if entry[3] == EXACT:
+                    return ttScore
+                elif entry[3] == LOWERBOUND:
+                    alpha = max(alpha, ttScore)
+                else:
+                    beta = min(beta, ttScore)
+                if alpha >= beta:
+                    return ttScore
+            hashMoveID = entry[4]
+
+        ply = rootDepth - depth
+        validMoves = self.orderMoves(validMoves, ply, hashMoveID)
+
+        maxScore = -CHECKMATE
+        bestMove = None
+        for i, move in enumerate(validMoves):
+            gs.makeMove(move)
+            # the quiescence search generates its own moves at the horizon
+            nextMoves = gs.getValidMoves() if depth > 1 else None
+            if depth == rootDepth and self.exactRoot:
+                # a root move as good as the best one must come back with its exact score, not a bound
+                score = -self.findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -(alpha - ROOT_TIE_MARGIN),
+                                                       -turnMultiplier)
+                if score > maxScore or (bestMove is not None and score == maxScore and
+                                        self.rootIndex[move.moveID] < self.rootIndex[bestMove.moveID]):
+                    maxScore = score
+                    bestMove = move
+                    self.nextMove = move
+            else:
+                score = -self.findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
+                if score > maxScore:
+                    maxScore = score
+                    bestMove = move
+                    if depth == rootDepth:
+                        self.nextMove = move
+            gs.undoMove()
+            if maxScore > alpha:
+                alpha = maxScore
+            if alpha >= beta and (depth != rootDepth or not self.exactRoot):  # exactRoot looks at every root move
+                self.betaCutoffs += 1
+                if i == 0:
+                    self.firstMoveCutoffs += 1
+                if not move.isCapture:
+                    self.storeCutoff(move, ply, depth)
+                break
+
+        if maxScore <= alphaOrig:
+            flag = UPPERBOUND
+        elif maxScore >= beta:
+            flag = LOWERBOUND
+        else:
+            flag = EXACT
+        self.transpositionTable.store(key, depth, maxScore, flag, bestMove)
+        return maxScore
+
+    def quiescenceSearch(self, gs, alpha, beta, turnMultiplier):
+        """
+        Search captures only until the position is quiet, so the evaluation is never taken in the middle of an exchange.
+        The side to move may also stand pat on the static evaluation, unless it is in check.
+        """
+        self.qnodes += 1
+        self.checkLimits()
+
+        moves = gs.getCaptureMoves()
+        if gs.inCheck:
+            # every evasion is searched, no standing pat in check
+            if len(moves) == 0:
+                return -CHECKMATE
+            maxScore = -CHECKMATE
+        else:
+            maxScore = turnMultiplier * scoreBoard(gs)
+            if maxScore >= beta:
+                return maxScore
+            if maxScore > alpha:
+                alpha = maxScore
+
+        moves.sort(key=mvvLvaScore, reverse=True)
+        for move in moves:
+            gs.makeMove(move)
+            score = -self.quiescenceSearch(gs, -beta, -alpha, -turnMultiplier)
+            gs.undoMove()
+            if score > maxScore:
+                maxScore = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return maxScore
+
+
+defaultSearcher = Searcher()  # used by findBestMove and searchBestMove
+
 
 def findRandomMoves(validMoves):
     if len(validMoves) > 0:
@@ -108,10 +608,7 @@ def findBestMoveBasicMinMax(gs, validMoves):
     return bestPlayerMove
 
 def findBestMoveMinMax(gs, validMoves):
-    global nextMove
-    nextMove = None
-    findMoveMinMax(gs, validMoves, DEPTH, gs.white_to_move)
-    return nextMove
+    return findMoveMinMax(gs, validMoves, DEPTH, gs.white_to_move)
 
 def findMoveMinMax(gs, validMoves, depth, whiteToMove):
     if depth == 0:
@@ -146,58 +643,44 @@ def findMoveMinMax(gs, validMoves, depth, whiteToMove):
 
 # New version: positive material score for white and black separately
 
-def findBestMove(gs, validMoves, returnQueue):
-    global nextMove
-    nextMove = None
-    random.shuffle(validMoves)
-    #findMoveMinMax(gs, validMoves, DEPTH, not gs.white_to_move)
-    #findMoveNegaMax(gs, validMoves, DEPTH, gs.white_to_move)
-    findMoveNegaMaxAlphaBeta(gs, validMoves, DEPTH, -CHECKMATE, CHECKMATE, 1 if gs.white_to_move else -1)
-    returnQueue.put(nextMove)
-
-def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
-    global nextMove
-    if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-    maxScore = -CHECKMATE
-    for move in validMoves:
-        gs.makeMove(move)
-        nextMoves = gs.getValidMoves()
-        #negative is important
-        score = -findMoveNegaMax(gs, nextMoves, depth - 1, -turnMultiplier)
-        score = max(score, maxScore)
-        if score > maxScore:
-            maxScore = score
-            if depth == DEPTH:
-                nextMove = move
-        gs.undoMove()
-    return maxScore
+def findBestMove(gs, validMoves, returnQueue, timeLimit=TIME_LIMIT, maxNodes=NODE_LIMIT, maxDepth=MAX_DEPTH,
+                 workers=ROOT_SPLIT_WORKERS):
+    """
+    Search the position and put the best move on returnQueue. With workers > 1 the root moves are split
+    over a pool of that many processes (see Chess_smp.searchSplitRoot).
+    """
+    if workers > 1:
+        import Chess_smp
+        returnQueue.put(Chess_smp.searchSplitRoot(gs, validMoves, workers, timeLimit, maxNodes, maxDepth))
+    else:
+        returnQueue.put(searchBestMove(gs, validMoves, timeLimit, maxNodes, maxDepth))
 
-def findMoveNegaMaxAlphaBeta(gs, validMoves, depth, alpha, beta, turnMultiplier):
+def searchBestMove(gs, validMoves, timeLimit=TIME_LIMIT, maxNodes=NODE_LIMIT, maxDepth=MAX_DEPTH, stop=None):
     """
-    Thuật toán Negamax với Alpha-Beta pruning
+    Iterative deepening search with the module's default Searcher, see Searcher.search
     """
-    global nextMove
+    defaultSearcher.setLimits(timeLimit, maxNodes, maxDepth)
+    return defaultSearcher.search(gs, validMoves, stop)
 
+def findMoveNegaMax(gs, validMoves, depth, turnMultiplier):
+    """
+    Plain negamax, returns (score, best move)
+    """
     if depth == 0:
-        return turnMultiplier * scoreBoard(gs)
-
+        return turnMultiplier * scoreBoard(gs), None
     maxScore = -CHECKMATE
+    bestMove = None
     for move in validMoves:
         gs.makeMove(move)
         nextMoves = gs.getValidMoves()
-        score = -findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -beta, -alpha, -turnMultiplier)
+        #negative is important
+        score = -findMoveNegaMax(gs, nextMoves, depth - 1, -turnMultiplier)[0]
+        score = max(score, maxScore)
         if score > maxScore:
             maxScore = score
-            if depth == DEPTH:
-                nextMove = move
+            bestMove = move
         gs.undoMove()
-        if maxScore > alpha:
-            alpha = maxScore
-        if alpha >= beta:
-            break
-    return maxScore
-
+    return maxScore, bestMove
 
 def scoreMaterial(board):
     white_score = 0
@@ -217,6 +700,7 @@ def scoreBoard(gs):
     """
     Đánh giá trạng thái bàn cờ
     Điểm dương cho trắng, âm cho đen
+    Material and piece-square scores are kept up to date by makeMove/undoMove, so this is O(1)
     """
     if gs.checkmate:  # sửa từ checkMate thành checkmate
         if gs.white_to_move:
@@ -226,26 +710,5 @@ def scoreBoard(gs):
     elif gs.stalemate:  # sửa từ staleMate thành stalemate
         return STALEMATE
 
-    score = 0
-    for row in range(len(gs.board)):
-        for col in range(len(gs.board[row])):
-            piece = gs.board[row][col]
-            if piece != "--":
-                piece_position_score = 0
-                if piece[1] == "N":
-                    piece_position_score = knight_scores[row][col]
-                elif piece[1] == "B":
-                    piece_position_score = bishop_scores[row][col]
-                elif piece[1] == "R":
-                    piece_position_score = rook_scores[row][col]
-                elif piece[1] == "Q":
-                    piece_position_score = queen_scores[row][col]
-                elif piece[1] == "p":
-                    piece_position_score = pawn_scores[row][col]
-
-                if piece[0] == 'w':
-                    score += pieceScore[piece[1]] + piece_position_score * .1
-                else:
-                    score -= pieceScore[piece[1]] + piece_position_score * .1
-
-    return score
+    # position_score is in hundredths and weighs a tenth of the material
+    return gs.material_score + gs.position_score * 0.001
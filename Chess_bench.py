@@ -0,0 +1,188 @@
+# Fixed-position search benchmark: searches a bundled set of positions to a fixed depth (or node count) with the
+# root shuffle off, so a run is reproducible, and reports total nodes, nodes per second and a signature.
+# The signature is a checksum of the node counts, depth and move of every position: it changes whenever the search
+# behaves differently, and stays the same for changes that only make it faster. Results can be written as JSON
+# and compared with an earlier run.
+#
+#   python Chess_bench.py                              depth 4 over every position
+#   python Chess_bench.py --depth 3 --json bench.json
+#   python Chess_bench.py --nodes 20000 --compare bench.json
+
+import argparse
+import json
+import subprocess
+import sys
+import time
+import zlib
+
+import Chess_engine, Chess_AI
+
+BENCH_DEPTH = 4
+COMPONENT_REPEAT = 20  # passes over the positions when timing getValidMoves and scoreBoard
+
+# Openings, middlegames and endgames, many of them from the Stockfish bench
+BENCH_POSITIONS = [
+    "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 10",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 11",
+    "4rrk1/pp1n3p/3q2pQ/2p1pb2/2PP4/2P3N1/P2B2PP/4RRK1 b - - 7 19",
+    "rq3rk1/ppp2ppp/1bnpb3/3N2B1/3NP3/7P/PPPQ1PP1/2KR3R w - - 7 14",
+    "r1bq1r1k/1pp1n1pp/1p1p4/4p2Q/4Pp2/1BNP4/PPP2PPP/3R1RK1 w - - 2 14",
+    "r3r1k1/2p2ppp/p1p1bn2/8/1q2P3/2NPQN2/PPP3PP/R4RK1 b - - 2 15",
+    "r1bbk1nr/pp3p1p/2n5/1N4p1/2Np1B2/8/PPP2PPP/2KR1B1R w kq - 0 13",
+    "r1bq1rk1/ppp1nppp/4n3/3p3Q/3P4/1BP1B3/PP1N2PP/R4RK1 w - - 1 16",
+    "4r1k1/r1q2ppp/ppp2n2/4P3/5Rb1/1N1BQ3/PPP3PP/R5K1 w - - 1 17",
+    "2rqkb1r/ppp2p2/2npb1p1/1N1Nn2p/2P1PP2/8/PP2B1PP/R1BQK2R b KQ - 0 11",
+    "r1bq1r1k/b1p1npp1/p2p3p/1p6/3PP3/1B2NN2/PP3PPP/R2Q1RK1 w - - 1 16",
+    "3r1rk1/p5pp/bpp1pp2/8/q1PP1P2/b3P3/P2NQRPP/1R2B1K1 b - - 6 22",
+    "r1q2rk1/2p1bppp/2Pp4/p6b/Q1PNp3/4B3/PP1R1PPP/2K4R w - - 2 18",
+    "4k2r/1pb2ppp/1p2p3/1R1p4/3P4/2r1PN2/P4PPP/1R4K1 b - - 3 22",
+    "3q2k1/pb3p1p/4pbp1/2r5/PpN2N2/1P2P2P/5PP1/Q2R2K1 b - - 4 26",
+    "6k1/6p1/6Pp/ppp5/3pn2P/1P3K2/1PP2P2/3N4 b - - 0 1",
+    "3b4/5kp1/1p1p1p1p/pP1PpP1P/P1P1P3/3KN3/8/8 w - - 0 1",
+    "2K5/p7/7P/5pR1/8/5k2/r7/8 w - - 0 1",
+    "8/6pk/1p6/8/PP3p1p/5P2/4KP1q/3Q4 w - - 0 1",
+    "7k/3p2pp/4q3/8/4Q3/5Kp1/P6b/8 w - - 0 1",
+    "8/2p5/8/2kPKp1p/2p4P/2P5/3P4/8 w - - 0 1",
+    "8/1p3pp1/7p/5P1P/2k3P1/8/2K2P2/8 w - - 0 1",
+    "8/pp2r1k1/2p1p3/3pP2p/1P1P1P1P/P5KR/8/8 w - - 0 1",
+    "8/3p4/p1bk3p/Pp6/1Kp1PpPp/2P2P1P/2P5/5B2 b - - 0 1",
+    "5k2/7R/4P2p/5K2/p1r2P1p/8/8/8 b - - 0 1",
+    "6k1/6p1/P6p/r1N5/5p2/7P/1b3PP1/4R1K1 w - - 0 1",
+    "1r3k2/4q3/2Pp3b/3Bp3/2Q2p2/1p1P2P1/1P2KP2/3N4 w - - 0 1",
+    "6k1/4pp1p/3p2p1/P1pPb3/R7/1r2P1PP/3B1P2/6K1 w - - 0 1",
+    "8/3p3B/5p2/5P2/p7/PP5b/k7/6K1 w - - 0 1",
+    "5rk1/q6p/2p3bR/1pPp1rP1/1P1Pp3/P3B1Q1/1K3P2/R7 w - - 93 90",
+    "4rrk1/1p1nq3/p7/2p1P1pp/3P2bp/3Q1Bn1/PPPB4/1K2R1NR w - - 40 21",
+    "r3k2r/3nnpbp/q2pp1p1/p7/Pp1PPPP1/4BNN1/1P5P/R2Q1RK1 w kq - 0 16",
+    "3Qb1k1/1r2ppb1/pN1n2q1/Pp1Pp1Pr/4P2p/4BP2/4B1R1/1R5K b - - 11 40",
+    "4k3/3q1r2/1N2r1b1/3ppN2/2nPP3/1B1R2n1/2R1Q3/3K4 w - - 5 1",
+    "8/8/8/8/5kp1/P7/8/1K1N4 w - - 0 1",
+    "8/8/8/5N2/8/p7/8/2NK3k w - - 0 1",
+    "8/3k4/8/8/8/4B3/4KB2/2B5 w - - 0 1",
+    "8/8/1P6/5pr1/8/4R3/7k/2K5 w - - 0 1",
+    "8/2p4P/8/kr6/6R1/8/8/1K6 w - - 0 1",
+    "8/8/3P3k/8/1p6/8/1P6/1K3n2 b - - 0 1",
+    "8/R7/2q5/8/6k1/8/1P5p/K6R w - - 0 124",
+    "6k1/3b3r/1p1p4/p1n2p2/1PPNpP1q/P3Q1p1/1R1RB1P1/5K2 b - - 0 1",
+    "r2r1n2/pp2bk2/2p1p2p/3q4/3PN1QP/2P3R1/P4PP1/5RK1 w - - 0 1",
+]
+
+
+def gitRevision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def signature(results):
+    """
+    CRC-32 of the move, depth and node counts of every position. With a node budget the total alone is the same
+    for every run, the split between main and quiescence nodes still changes with the search.
+    """
+    text = ";".join("%s %d %d %d" % (result["move"], result["depth"], result["nodes"], result["qnodes"])
+                    for result in results)
+    return zlib.crc32(text.encode())
+
+
+def timeComponents(positions, repeat=COMPONENT_REPEAT):
+    """
+    Microseconds per call of getValidMoves and scoreBoard over the positions
+    """
+    states = [Chess_engine.GameState.from_fen(fen) for fen in positions]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for gs in states:
+            gs.getValidMoves()
+    moveGeneration = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for gs in states:
+            Chess_AI.scoreBoard(gs)
+    evaluation = time.perf_counter() - start
+    calls = repeat * len(states)
+    return {"getValidMoves_us": 1e6 * moveGeneration / calls, "scoreBoard_us": 1e6 * evaluation / calls}
+
+
+def runBench(depth=BENCH_DEPTH, maxNodes=None, positions=BENCH_POSITIONS, out=sys.stdout):
+    """
+    Search every position with a fresh table and return the results as a dict, see the module comment
+    """
+    searcher = Chess_AI.Searcher(timeLimit=None, maxNodes=maxNodes, maxDepth=depth, collectStats=False, shuffle=False)
+    results = []
+    totalNodes = 0
+    totalTime = 0.0
+    for number, fen in enumerate(positions, 1):
+        gs = Chess_engine.GameState.from_fen(fen)
+        searcher.newGame()
+        bestMove, stats = searcher.searchWithStats(gs, gs.getValidMoves())
+        totalNodes += stats.totalNodes()
+        totalTime += stats.seconds
+        results.append({"fen": fen, "move": bestMove.getUciNotation() if bestMove is not None else None,
+                        "score": searcher.lastScore, "depth": stats.depth, "nodes": stats.nodes,
+                        "qnodes": stats.qnodes, "seconds": stats.seconds})
+        out.write("position %2d/%d %-6s depth %d %8d nodes %6.2fs\n" %
+                  (number, len(positions), results[-1]["move"], stats.depth, stats.totalNodes(), stats.seconds))
+    return {"revision": gitRevision(), "depth": depth, "maxNodes": maxNodes, "positions": results,
+            "nodes": totalNodes, "seconds": totalTime, "nps": totalNodes / totalTime if totalTime > 0 else 0.0,
+            "signature": signature(results), "components": timeComponents(positions)}
+
+
+def compare(result, baseline, out=sys.stdout):
+    """
+    Print what changed since the baseline run. Returns the relative change in nodes per second.
+    """
+    if (result["depth"], result["maxNodes"]) != (baseline["depth"], baseline["maxNodes"]):
+        out.write("baseline was run with depth %s, nodes %s: signatures are not comparable\n" %
+                  (baseline["depth"], baseline["maxNodes"]))
+    elif result["signature"] == baseline["signature"]:
+        out.write("signature unchanged (%d)\n" % result["signature"])
+    else:
+        out.write("signature changed: %d -> %d\n" % (baseline["signature"], result["signature"]))
+        old = {position["fen"]: position for position in baseline["positions"]}
+        for position in result["positions"]:
+            before = old.get(position["fen"])
+            if before is not None and (before["nodes"], before["qnodes"], before["move"]) != \
+                    (position["nodes"], position["qnodes"], position["move"]):
+                out.write("  %s: %s %d+%d -> %s %d+%d nodes\n" %
+                          (position["fen"], before["move"], before["nodes"], before["qnodes"],
+                           position["move"], position["nodes"], position["qnodes"]))
+    change = result["nps"] / baseline["nps"] - 1 if baseline["nps"] > 0 else 0.0
+    out.write("nodes/s %.0f -> %.0f (%+.1f%%)\n" % (baseline["nps"], result["nps"], 100 * change))
+    for name, value in result["components"].items():
+        if name in baseline.get("components", {}):
+            out.write("%s %.1f -> %.1f\n" % (name, baseline["components"][name], value))
+    return change
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fixed-position search benchmark")
+    parser.add_argument("--depth", type=int, default=BENCH_DEPTH, help="depth every position is searched to")
+    parser.add_argument("--nodes", type=int, help="node budget per position instead of a fixed depth")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="JSON file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=10.0,
+                        help="exit with 1 when nodes/s dropped by more than this many percent against --compare")
+    args = parser.parse_args(argv)
+    depth = Chess_AI.MAX_DEPTH if args.nodes is not None else args.depth
+    result = runBench(depth, args.nodes)
+    print("\n%d positions, %d nodes in %.2fs, %.0f nodes/s" %
+          (len(result["positions"]), result["nodes"], result["seconds"], result["nps"]))
+    print("getValidMoves %.1fus, scoreBoard %.1fus per call" %
+          (result["components"]["getValidMoves_us"], result["components"]["scoreBoard_us"]))
+    print("signature %d" % result["signature"])
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(result, file, indent=1)
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+        if compare(result, baseline) < -args.tolerance / 100:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
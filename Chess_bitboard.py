@@ -0,0 +1,338 @@
+# Bitboard move generation backend for Chess_engine.GameState.
+# Square index is row * 8 + col, the same numbering as the board list: a8 = 0, h8 = 7, a1 = 56, h1 = 63.
+# A bitboard is a Python int with bit i set when square i is occupied by that piece.
+
+import Chess_engine
+
+PIECES = ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")
+FULL = (1 << 64) - 1
+
+
+def _onBoard(row, col):
+    return 0 <= row < 8 and 0 <= col < 8
+
+
+def _stepTable(steps):
+    table = []
+    for sq in range(64):
+        row, col = divmod(sq, 8)
+        mask = 0
+        for dr, dc in steps:
+            if _onBoard(row + dr, col + dc):
+                mask |= 1 << ((row + dr) * 8 + col + dc)
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = _stepTable(((-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)))
+KING_ATTACKS = _stepTable(((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)))
+# squares attacked by a pawn of the given colour standing on each square
+PAWN_ATTACKS = {"w": _stepTable(((-1, -1), (-1, 1))), "b": _stepTable(((1, -1), (1, 1)))}
+
+# Rays for the classical sliding-attack scheme: RAYS[d][sq] holds every square from sq to the edge in direction d.
+# The first blocker on a ray is its lowest set bit when the direction walks towards higher indices, its highest
+# set bit otherwise; everything behind the blocker is cut off with the blocker's own ray.
+DIRECTIONS = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))  # same order as checkForPinsAndChecks
+POSITIVE = tuple(dr * 8 + dc > 0 for dr, dc in DIRECTIONS)
+RAYS = []
+for _dr, _dc in DIRECTIONS:
+    _rays = []
+    for _sq in range(64):
+        _row, _col = divmod(_sq, 8)
+        _mask = 0
+        _row += _dr
+        _col += _dc
+        while _onBoard(_row, _col):
+            _mask |= 1 << (_row * 8 + _col)
+            _row += _dr
+            _col += _dc
+        _rays.append(_mask)
+    RAYS.append(_rays)
+
+# BETWEEN[a][b]: squares strictly between a and b when they share a line, 0 otherwise
+BETWEEN = [[0] * 64 for _ in range(64)]
+for _d in range(8):
+    for _a in range(64):
+        _ray = RAYS[_d][_a]
+        _b = _ray
+        while _b:
+            _low = _b & -_b
+            _target = _low.bit_length() - 1
+            BETWEEN[_a][_target] = _ray & ~RAYS[_d][_target] & ~_low
+            _b ^= _low
+
+
+def lsb(b):
+    return (b & -b).bit_length() - 1
+
+
+def rayAttacks(sq, occupied, d):
+    ray = RAYS[d][sq]
+    blockers = ray & occupied
+    if blockers:
+        first = (blockers & -blockers).bit_length() - 1 if POSITIVE[d] else blockers.bit_length() - 1
+        ray ^= RAYS[d][first]
+    return ray
+
+
+def rookAttacks(sq, occupied):
+    return (rayAttacks(sq, occupied, 0) | rayAttacks(sq, occupied, 1) |
+            rayAttacks(sq, occupied, 2) | rayAttacks(sq, occupied, 3))
+
+
+def bishopAttacks(sq, occupied):
+    return (rayAttacks(sq, occupied, 4) | rayAttacks(sq, occupied, 5) |
+            rayAttacks(sq, occupied, 6) | rayAttacks(sq, occupied, 7))
+
+
+def fromBoard(board):
+    """
+    Build the 12 piece bitboards of a board list
+    """
+    bitboards = {piece: 0 for piece in PIECES}
+    for r in range(8):
+        for c in range(8):
+            piece = board[r][c]
+            if piece != "--":
+                bitboards[piece] |= 1 << (r * 8 + c)
+    return bitboards
+
+
+def toggleMove(bitboards, move, end_piece):
+    """
+    Flip the bits a move changes. Every change is an XOR, so the same call plays the move and takes it back.
+    end_piece is what stands on the end square after the move, the promoted piece for a promotion.
+    """
+    start = move.startRow * 8 + move.startCol
+    end = move.endRow * 8 + move.endCol
+    bitboards[move.pieceMoved] ^= 1 << start
+    bitboards[end_piece] ^= 1 << end
+    if move.isEnpassantMove:
+        bitboards[move.pieceCaptured] ^= 1 << (move.startRow * 8 + move.endCol)
+    elif move.pieceCaptured != "--":
+        bitboards[move.pieceCaptured] ^= 1 << end
+    if move.isCastleMove:
+        if move.endCol - move.startCol == 2:  # king side
+            bitboards[move.pieceMoved[0] + "R"] ^= (1 << (end + 1)) | (1 << (end - 1))
+        else:
+            bitboards[move.pieceMoved[0] + "R"] ^= (1 << (end - 2)) | (1 << (end + 1))
+
+
+def colorOccupancy(bitboards, color):
+    return (bitboards[color + "P"] | bitboards[color + "N"] | bitboards[color + "B"] |
+            bitboards[color + "R"] | bitboards[color + "Q"] | bitboards[color + "K"])
+
+
+def attackersTo(bitboards, sq, occupied, color):
+    """
+    Bitboard of the pieces of the given colour that attack sq
+    """
+    attackers = KNIGHT_ATTACKS[sq] & bitboards[color + "N"]
+    attackers |= KING_ATTACKS[sq] & bitboards[color + "K"]
+    # a pawn of `color` attacks sq from the squares a pawn of the other colour on sq would attack
+    attackers |= PAWN_ATTACKS["b" if color == "w" else "w"][sq] & bitboards[color + "P"]
+    rooks = bitboards[color + "R"] | bitboards[color + "Q"]
+    if rooks:
+        attackers |= rookAttacks(sq, occupied) & rooks
+    bishops = bitboards[color + "B"] | bitboards[color + "Q"]
+    if bishops:
+        attackers |= bishopAttacks(sq, occupied) & bishops
+    return attackers
+
+
+def isSquareAttacked(gs, row, col, color):
+    bitboards = gs.bitboards
+    occupied = colorOccupancy(bitboards, "w") | colorOccupancy(bitboards, "b")
+    return attackersTo(bitboards, row * 8 + col, occupied, color) != 0
+
+
+def attackersOf(gs, square, color, first_only=False, empty=None):
+    bitboards = gs.bitboards
+    occupied = colorOccupancy(bitboards, "w") | colorOccupancy(bitboards, "b")
+    if empty is not None:
+        occupied &= ~(1 << (empty[0] * 8 + empty[1]))
+    attackers = attackersTo(bitboards, square[0] * 8 + square[1], occupied, color)
+    squares = []
+    while attackers:
+        low = attackers & -attackers
+        sq = low.bit_length() - 1
+        squares.append((sq >> 3, sq & 7))
+        if first_only:
+            break
+        attackers ^= low
+    return squares
+
+
+def _addMoves(moves, board, sq, targets):
+    start = (sq >> 3, sq & 7)
+    while targets:
+        low = targets & -targets
+        target = low.bit_length() - 1
+        moves.append(Chess_engine.Move(start, (target >> 3, target & 7), board))
+        targets ^= low
+
+
+def generateMoves(gs, captures_only=False):
+    """
+    Legal moves of the side to move, straight from the bitboards: pins and checks are found by
+    looking outward from the king, king moves are checked against the attacks with the king lifted
+    off the board. With captures_only only captures and promotions are generated, unless in check.
+    Sets gs.inCheck like the mailbox generator does.
+    """
+    bitboards = gs.bitboards
+    board = gs.board
+    us, them = ("w", "b") if gs.white_to_move else ("b", "w")
+    ours = colorOccupancy(bitboards, us)
+    theirs = colorOccupancy(bitboards, them)
+    occupied = ours | theirs
+    king = lsb(bitboards[us + "K"])
+    checkers = attackersTo(bitboards, king, occupied, them)
+    gs.inCheck = checkers != 0
+    if gs.inCheck:
+        captures_only = False
+    moves = []
+
+    # king moves, tested with the king lifted so sliders see through its old square
+    targets = KING_ATTACKS[king] & ~ours
+    if captures_only:
+        targets &= theirs
+    without_king = occupied ^ (1 << king)
+    while targets:
+        low = targets & -targets
+        target = low.bit_length() - 1
+        if not attackersTo(bitboards, target, without_king, them):
+            moves.append(Chess_engine.Move((king >> 3, king & 7), (target >> 3, target & 7), board))
+        targets ^= low
+    if checkers & (checkers - 1):  # double check, only the king can move
+        return moves
+
+    # squares the other pieces may move to
+    if checkers:
+        checker = lsb(checkers)
+        target_mask = checkers | BETWEEN[king][checker]
+    else:
+        target_mask = FULL
+    target_mask &= ~ours
+    push_mask = target_mask  # promotions are generated even when only captures are asked for
+    if captures_only:
+        target_mask &= theirs
+
+    # pinned pieces may only move along the line between the king and the pinner
+    pin_lines = {}
+    their_rooks = bitboards[them + "R"] | bitboards[them + "Q"]
+    their_bishops = bitboards[them + "B"] | bitboards[them + "Q"]
+    for d in range(8):
+        sliders = their_rooks if d < 4 else their_bishops
+        if not sliders or not (RAYS[d][king] & sliders):
+            continue
+        blockers = RAYS[d][king] & occupied
+        if not blockers:
+            continue
+        first = lsb(blockers) if POSITIVE[d] else blockers.bit_length() - 1
+        if not (ours >> first) & 1:
+            continue
+        beyond = RAYS[d][first] & occupied
+        if not beyond:
+            continue
+        second = lsb(beyond) if POSITIVE[d] else beyond.bit_length() - 1
+        if (sliders >> second) & 1:
+            pin_lines[first] = BETWEEN[king][second] | (1 << second)
+
+    for kind, attacks in (("N", None), ("B", bishopAttacks), ("R", rookAttacks), ("Q", None)):
+        pieces = bitboards[us + kind]
+        while pieces:
+            low = pieces & -pieces
+            sq = low.bit_length() - 1
+            pieces ^= low
+            if kind == "N":
+                if sq in pin_lines:
+                    continue  # a pinned knight can never move
+                targets = KNIGHT_ATTACKS[sq]
+            elif kind == "Q":
+                targets = rookAttacks(sq, occupied) | bishopAttacks(sq, occupied)
+            else:
+                targets = attacks(sq, occupied)
+            targets &= target_mask
+            if sq in pin_lines:
+                targets &= pin_lines[sq]
+            _addMoves(moves, board, sq, targets)
+
+    # pawns
+    forward = -8 if us == "w" else 8
+    start_row = 6 if us == "w" else 1
+    last_row = 0 if us == "w" else 7
+    ep_square = gs.en_passant_possible[0] * 8 + gs.en_passant_possible[1] if gs.en_passant_possible != () else -1
+    pawns = bitboards[us + "P"]
+    while pawns:
+        low = pawns & -pawns
+        sq = low.bit_length() - 1
+        pawns ^= low
+        allowed = target_mask
+        push_allowed = push_mask
+        if sq in pin_lines:
+            allowed &= pin_lines[sq]
+            push_allowed &= pin_lines[sq]
+        start = (sq >> 3, sq & 7)
+        one = sq + forward
+        if not (occupied >> one) & 1:
+            if (not captures_only or one >> 3 == last_row) and (push_allowed >> one) & 1:
+                Chess_engine.addPawnMove(moves, start, (one >> 3, one & 7), board)
+            two = one + forward
+            if not captures_only and sq >> 3 == start_row and not (occupied >> two) & 1 and (push_allowed >> two) & 1:
+                moves.append(Chess_engine.Move(start, (two >> 3, two & 7), board))
+        captures = PAWN_ATTACKS[us][sq] & theirs & allowed
+        while captures:
+            low = captures & -captures
+            target = low.bit_length() - 1
+            Chess_engine.addPawnMove(moves, start, (target >> 3, target & 7), board)
+            captures ^= low
+        if ep_square >= 0 and (PAWN_ATTACKS[us][sq] >> ep_square) & 1:
+            captured = ep_square - forward
+            # legal if it resolves any check and doesn't uncover one once both pawns have left the rank
+            if (not checkers or (checkers >> captured) & 1 or (target_mask >> ep_square) & 1) and \
+                    (sq not in pin_lines or (pin_lines[sq] >> ep_square) & 1):
+                after = occupied ^ (1 << sq) ^ (1 << captured) | (1 << ep_square)
+                bitboards[them + "P"] ^= 1 << captured
+                exposed = attackersTo(bitboards, king, after, them)
+                bitboards[them + "P"] ^= 1 << captured
+                if not exposed:
+                    moves.append(Chess_engine.Move(start, (ep_square >> 3, ep_square & 7), board, isEnpassantMove=True))
+
+    # castling
+    if not checkers and not captures_only:
+        rights = gs.current_castling_rights
+        row = 7 if us == "w" else 0
+        base = row * 8
+        if (rights.wks if us == "w" else rights.bks) and king == base + 4 and (bitboards[us + "R"] >> (base + 7)) & 1:
+            if not occupied & ((1 << (base + 5)) | (1 << (base + 6))) and \
+                    not attackersTo(bitboards, base + 5, occupied, them) and \
+                    not attackersTo(bitboards, base + 6, occupied, them):
+                moves.append(Chess_engine.Move((row, 4), (row, 6), board, isCastleMove=True))
+        if (rights.wqs if us == "w" else rights.bqs) and king == base + 4 and (bitboards[us + "R"] >> base) & 1:
+            if not occupied & ((1 << (base + 1)) | (1 << (base + 2)) | (1 << (base + 3))) and \
+                    not attackersTo(bitboards, base + 3, occupied, them) and \
+                    not attackersTo(bitboards, base + 2, occupied, them):
+                moves.append(Chess_engine.Move((row, 4), (row, 2), board, isCastleMove=True))
+    return moves
+
+
+def getValidMoves(gs):
+    moves = generateMoves(gs)
+    if len(moves) == 0:
+        if gs.inCheck:
+            gs.checkmate = True
+        else:
+            gs.stalemate = True
+    else:
+        gs.checkmate = False
+        gs.stalemate = False
+    return moves
+
+
+def getCaptureMoves(gs):
+    moves = generateMoves(gs, captures_only=True)
+    if gs.inCheck:
+        # like the mailbox generator, all evasions were generated and the mate flags are up to date
+        gs.checkmate = len(moves) == 0
+        gs.stalemate = False
+    return moves
@@ -1,7 +1,118 @@
 # This class is responsible for storing all the information about the current state of a chess game. It will also be responsible for determining the valid moves at the current states. It will also keep a move log
 
+import random
+import Chess_bitboard
+
+# Zobrist hashing: one random 64-bit number per piece on each square, per castling rights combination,
+# per en passant file and one for black to move. The key of a position is the XOR of all that apply.
+_zobristRandom = random.Random(0x5EED)
+zobristPieces = {piece: [_zobristRandom.getrandbits(64) for _ in range(64)]
+                 for piece in ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK")}
+zobristCastle = [_zobristRandom.getrandbits(64) for _ in range(16)]  # indexed by CastleRights.bits()
+zobristEnPassant = [_zobristRandom.getrandbits(64) for _ in range(8)]  # indexed by file
+zobristBlackToMove = _zobristRandom.getrandbits(64)
+
+# Recompute the key from scratch after every makeMove/undoMove and compare it with the incremental one
+VERIFY_ZOBRIST = False
+
+# Chess.com-style scoring
+pieceScore = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+
+knight_scores = [[0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0],
+                 [0.1, 0.3, 0.5, 0.5, 0.5, 0.5, 0.3, 0.1],
+                 [0.2, 0.5, 0.6, 0.65, 0.65, 0.6, 0.5, 0.2],
+                 [0.2, 0.55, 0.65, 0.7, 0.7, 0.65, 0.55, 0.2],
+                 [0.2, 0.5, 0.65, 0.7, 0.7, 0.65, 0.5, 0.2],
+                 [0.2, 0.55, 0.6, 0.65, 0.65, 0.6, 0.55, 0.2],
+                 [0.1, 0.3, 0.5, 0.55, 0.55, 0.5, 0.3, 0.1],
+                 [0.0, 0.1, 0.2, 0.2, 0.2, 0.2, 0.1, 0.0]]
+
+bishop_scores = [[0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0],
+                 [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                 [0.2, 0.4, 0.5, 0.6, 0.6, 0.5, 0.4, 0.2],
+                 [0.2, 0.5, 0.5, 0.6, 0.6, 0.5, 0.5, 0.2],
+                 [0.2, 0.4, 0.6, 0.6, 0.6, 0.6, 0.4, 0.2],
+                 [0.2, 0.6, 0.6, 0.6, 0.6, 0.6, 0.6, 0.2],
+                 [0.2, 0.5, 0.4, 0.4, 0.4, 0.4, 0.5, 0.2],
+                 [0.0, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.0]]
+
+rook_scores = [[0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25],
+               [0.5, 0.75, 0.75, 0.75, 0.75, 0.75, 0.75, 0.5],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.0, 0.25, 0.25, 0.25, 0.25, 0.25, 0.25, 0.0],
+               [0.25, 0.25, 0.25, 0.5, 0.5, 0.25, 0.25, 0.25]]
+
+queen_scores = [[0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0],
+                [0.2, 0.4, 0.4, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.3, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.4, 0.4, 0.5, 0.5, 0.5, 0.5, 0.4, 0.3],
+                [0.2, 0.5, 0.5, 0.5, 0.5, 0.5, 0.4, 0.2],
+                [0.2, 0.4, 0.5, 0.4, 0.4, 0.4, 0.4, 0.2],
+                [0.0, 0.2, 0.2, 0.3, 0.3, 0.2, 0.2, 0.0]]
+
+pawn_scores = [[0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8, 0.8],
+               [0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7, 0.7],
+               [0.3, 0.3, 0.4, 0.5, 0.5, 0.4, 0.3, 0.3],
+               [0.25, 0.25, 0.3, 0.45, 0.45, 0.3, 0.25, 0.25],
+               [0.2, 0.2, 0.2, 0.4, 0.4, 0.2, 0.2, 0.2],
+               [0.25, 0.15, 0.1, 0.2, 0.2, 0.1, 0.15, 0.25],
+               [0.25, 0.3, 0.3, 0.0, 0.0, 0.3, 0.3, 0.25],
+               [0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2, 0.2]]
+
+piece_position_scores = {"wN": knight_scores,
+                         "bN": knight_scores[::-1],
+                         "wB": bishop_scores,
+                         "bB": bishop_scores[::-1],
+                         "wQ": queen_scores,
+                         "bQ": queen_scores[::-1],
+                         "wR": rook_scores,
+                         "bR": rook_scores[::-1],
+                         "wp": pawn_scores,
+                         "bp": pawn_scores[::-1]}
+
+# Material of each piece and its positional bonus on each square (in hundredths, so sums stay exact),
+# positive for white and negative for black. Only knights, bishops, rooks and queens get a positional
+# bonus in Chess_AI.scoreBoard.
+pieceMaterial = {}
+piecePositionValues = {}
+for _piece in ("wP", "wN", "wB", "wR", "wQ", "wK", "bP", "bN", "bB", "bR", "bQ", "bK"):
+    _sign = 1 if _piece[0] == "w" else -1
+    _table = {"N": knight_scores, "B": bishop_scores, "R": rook_scores, "Q": queen_scores}.get(_piece[1])
+    pieceMaterial[_piece] = _sign * pieceScore[_piece[1]]
+    piecePositionValues[_piece] = [_sign * round(_table[sq // 8][sq % 8] * 100) if _table else 0 for sq in range(64)]
+
+# Recompute material and positional scores from scratch after every makeMove/undoMove and compare
+VERIFY_EVAL = False
+# Same for the squares of each side's pieces
+VERIFY_PIECE_SQUARES = False
+# Check that makeMove only records state undoMove can rebuild exactly, see UNDO_STRIDE
+VERIFY_UNDO_STACK = False
+
+# Rook directions first, then bishop directions
+attackDirections = ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1))
+knightJumps = ((-2, -1), (-2, 1), (-1, 2), (1, 2), (2, -1), (2, 1), (-1, -2), (1, -2))
+# (row, col) of every square, built once so makeMove/undoMove don't make a new tuple for each square they touch
+boardSquares = tuple((r, c) for r in range(8) for c in range(8))
+
+# makeMove saves what undoMove can't work out backwards in a flat list allocated up front, UNDO_STRIDE slots
+# per ply: castling bits | (en passant file + 1) << 4 (0 without en passant), halfmove clock, Zobrist key,
+# material score and position score. Nothing is allocated per ply, the list only doubles in very long games.
+UNDO_STRIDE = 5
+UNDO_PLIES = 512
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1"
+fenPieces = {char: ("w" if char.isupper() else "b") + char.upper() for char in "KQRBNPkqrbnp"}
+
+
+
 class GameState():
-    def __init__(self):
+    def __init__(self, backend="mailbox"):
+        # backend picks the move generator: "mailbox" walks the board list below,
+        # "bitboard" also keeps 12 piece bitboards and generates moves from them (see Chess_bitboard)
         # Board is a 8x8 each element of the list has 2 characters
         # The first character represent the color of the piece, 'b' or 'w'
         # The second character represents the type of the piece, 'K', 'Q', 'R', 'B', 'N', or 'P'
@@ -16,6 +127,8 @@ class GameState():
             ["wR", "wN", "wB", "wQ", "wK", "wB", "wN", "wR"],
         ]
         self.moveFunctions= {'P': self.getPawnMoves, 'R': self.getRockMoves, 'N': self.getKnightMoves, 'B': self.getBishopMoves, 'Q': self.getQueenMoves, 'K': self.getKingMoves}
+        self.captureFunctions = {'P': self.getPawnCaptures, 'R': self.getRockCaptures, 'N': self.getKnightCaptures,
+                                 'B': self.getBishopCaptures, 'Q': self.getQueenCaptures, 'K': self.getKingCaptures}
         self.white_to_move = True
         self.move_log = []
         self.white_king_location = (7, 4)
@@ -26,25 +139,242 @@ class GameState():
         self.pins = []
         self.checks = []
         self.current_castling_rights = CastleRights(True, True, True, True)
-        self.castle_rights_log = [CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks, 
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs)]
         self.en_passant_possible = ()  # tọa độ ô có thể en passant
-        self.en_passant_log = [self.en_passant_possible]
+        self.halfmove_clock = 0  # plies since the last capture or pawn move, for the fifty-move rule
+        self.fullmove_number = 1
+        self.zobrist_key = self.computeZobristKey()
+        self.material_score, self.position_score = self.computeEvalScores()
+        # one record per move in move_log, see UNDO_STRIDE
+        self.undo_stack = [0] * (UNDO_STRIDE * UNDO_PLIES)
+        self.ply = 0
+        # (row, col) of every piece of each side, so move generation doesn't scan the empty squares.
+        # A promotion keeps its square, only moves, captures and castling change the sets.
+        self.piece_squares = self.computePieceSquares()
+        if backend not in ("mailbox", "bitboard"):
+            raise ValueError("unknown move generation backend: " + str(backend))
+        self.backend = backend
+        self.bitboards = Chess_bitboard.fromBoard(self.board) if backend == "bitboard" else None
+
+    @classmethod
+    def from_fen(cls, fen, backend="mailbox"):
+        """
+        New game state set up from a FEN string
+        """
+        gs = cls(backend)
+        gs.setFen(fen)
+        return gs
+
+    def setFen(self, fen):
+        """
+        Replace the position with the one of a FEN string and clear the move history.
+        The move counters may be left out, as in EPD.
+        """
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("FEN needs 4 or 6 fields: " + fen)
+        placement, side, castling, en_passant = fields[:4]
+        board = []
+        white_king = black_king = None
+        for rank in placement.split("/"):
+            row = []
+            for char in rank:
+                piece = fenPieces.get(char)
+                if piece is not None:
+                    if piece == "wK":
+                        white_king = (len(board), len(row))
+                    elif piece == "bK":
+                        black_king = (len(board), len(row))
+                    row.append(piece)
+                elif char in "12345678":
+                    row.extend(["--"] * int(char))
+                else:
+                    raise ValueError("bad piece " + repr(char) + " in FEN: " + fen)
+            if len(row) != 8:
+                raise ValueError("rank without 8 squares in FEN: " + fen)
+            board.append(row)
+        if len(board) != 8 or white_king is None or black_king is None or side not in ("w", "b"):
+            raise ValueError("bad FEN: " + fen)
+
+        self.board = board
+        self.white_to_move = side == "w"
+        self.white_king_location = white_king
+        self.black_king_location = black_king
+        self.move_log = []
+        self.checkmate = False
+        self.stalemate = False
+        self.in_check = False
+        self.pins = []
+        self.checks = []
+        self.current_castling_rights = CastleRights("K" in castling, "k" in castling, "Q" in castling, "q" in castling)
+        if en_passant == "-":
+            self.en_passant_possible = ()
+        elif en_passant[0] in Move.filesToCols and en_passant[1:] == ("6" if side == "w" else "3"):
+            self.en_passant_possible = (Move.ranksToRows[en_passant[1]], Move.filesToCols[en_passant[0]])
+        else:
+            raise ValueError("bad en passant square in FEN: " + fen)
+        self.halfmove_clock = int(fields[4]) if len(fields) == 6 else 0
+        self.fullmove_number = int(fields[5]) if len(fields) == 6 else 1
+        self.zobrist_key = self.computeZobristKey()
+        self.material_score, self.position_score = self.computeEvalScores()
+        self.ply = 0
+        self.piece_squares = self.computePieceSquares()
+        if self.bitboards is not None:
+            self.bitboards = Chess_bitboard.fromBoard(self.board)
+
+    def to_fen(self):
+        """
+        FEN string of the current position
+        """
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += piece[1] if piece[0] == "w" else piece[1].lower()
+            if empty:
+                rank += str(empty)
+            ranks.append(rank)
+        rights = self.current_castling_rights
+        castling = ("K" if rights.wks else "") + ("Q" if rights.wqs else "") + ("k" if rights.bks else "") + ("q" if rights.bqs else "")
+        if self.en_passant_possible != ():
+            en_passant = Move.colsToFiles[self.en_passant_possible[1]] + Move.rowsToRanks[self.en_passant_possible[0]]
+        else:
+            en_passant = "-"
+        return " ".join(("/".join(ranks), "w" if self.white_to_move else "b", castling or "-", en_passant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def computeZobristKey(self):
+        """
+        Compute the Zobrist key of the current position from scratch
+        """
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    key ^= zobristPieces[piece][r * 8 + c]
+        key ^= zobristCastle[self.current_castling_rights.bits()]
+        if self.en_passant_possible != ():
+            key ^= zobristEnPassant[self.en_passant_possible[1]]
+        if not self.white_to_move:
+            key ^= zobristBlackToMove
+        return key
+
+    def computeEvalScores(self):
+        """
+        Material and piece-square scores of the current position from scratch, white minus black
+        """
+        material = 0
+        position = 0
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    material += pieceMaterial[piece]
+                    position += piecePositionValues[piece][r * 8 + c]
+        return material, position
+
+    def computePieceSquares(self):
+        """
+        Squares of the white and the black pieces from scratch
+        """
+        squares = {"w": set(), "b": set()}
+        for r in range(8):
+            for c in range(8):
+                piece = self.board[r][c]
+                if piece != "--":
+                    squares[piece[0]].add((r, c))
+        return squares
+
+    def verifyPieceSquares(self):
+        if self.piece_squares != self.computePieceSquares():
+            raise AssertionError("piece squares out of sync after " +
+                                 (str(self.move_log[-1]) if self.move_log else "undo to start position"))
+
+    def verifyEvalScores(self):
+        if (self.material_score, self.position_score) != self.computeEvalScores():
+            raise AssertionError("incremental evaluation out of sync after " +
+                                 (str(self.move_log[-1]) if self.move_log else "undo to start position"))
+
+    def verifyZobristKey(self):
+        if self.zobrist_key != self.computeZobristKey():
+            raise AssertionError("incremental Zobrist key out of sync after " +
+                                 (str(self.move_log[-1]) if self.move_log else "undo to start position"))
+
+    def verifyUndoRecord(self):
+        # only the en passant file is recorded, undoMove puts the square on the 6th rank of the side to move
+        if self.en_passant_possible != () and self.en_passant_possible[0] != (2 if self.white_to_move else 5):
+            raise AssertionError("en passant square %s can't be restored by undoMove, side to move %s" %
+                                 (self.en_passant_possible, "white" if self.white_to_move else "black"))
+
+    def repetitionCount(self):
+        """
+        How many times the current position occurred since the last capture or pawn move, this time included
+        """
+        stack = self.undo_stack
+        key = self.zobrist_key
+        first = max(0, self.ply - self.halfmove_clock)
+        # only positions with the same side to move, two plies apart, can be the same
+        return 1 + sum(1 for ply in range(self.ply - 2, first - 1, -2) if stack[ply * UNDO_STRIDE + 2] == key)
 
     def makeMove(self, move):
         if self.checkmate:  # If in checkmate, don't allow any moves
             return False
-            
+
+        # save the state the move overwrites, the record of this ply is reused from the last time
+        castle_bits = self.current_castling_rights.bits()
+        stack = self.undo_stack
+        i = self.ply * UNDO_STRIDE
+        if i == len(stack):
+            stack.extend([0] * len(stack))
+        if VERIFY_UNDO_STACK:
+            self.verifyUndoRecord()
+        stack[i] = castle_bits | (self.en_passant_possible[1] + 1 << 4 if self.en_passant_possible != () else 0)
+        stack[i + 1] = self.halfmove_clock
+        stack[i + 2] = self.zobrist_key
+        stack[i + 3] = self.material_score
+        stack[i + 4] = self.position_score
+        self.ply += 1
+
+        # take the old side to move, castling rights and en passant file out of the key
+        key = self.zobrist_key ^ zobristCastle[castle_bits]
+        if self.en_passant_possible != ():
+            key ^= zobristEnPassant[self.en_passant_possible[1]]
+        if not self.white_to_move:
+            key ^= zobristBlackToMove
+        startSquare = move.startRow * 8 + move.startCol
+        endSquare = move.endRow * 8 + move.endCol
+        key ^= zobristPieces[move.pieceMoved][startSquare] ^ zobristPieces[move.pieceMoved][endSquare]
+        moved_values = piecePositionValues[move.pieceMoved]
+        material = self.material_score
+        position = self.position_score + moved_values[endSquare] - moved_values[startSquare]
+        if move.pieceCaptured != "--" and not move.isEnpassantMove:
+            key ^= zobristPieces[move.pieceCaptured][endSquare]
+            material -= pieceMaterial[move.pieceCaptured]
+            position -= piecePositionValues[move.pieceCaptured][endSquare]
+
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.move_log.append(move)
         self.white_to_move = not self.white_to_move
+        own_squares = self.piece_squares[move.pieceMoved[0]]
+        own_squares.remove(boardSquares[startSquare])
+        own_squares.add(boardSquares[endSquare])
+        if move.pieceCaptured != "--":
+            enemy_squares = self.piece_squares[move.pieceCaptured[0]]
+            enemy_squares.remove(boardSquares[move.startRow * 8 + move.endCol if move.isEnpassantMove else endSquare])
         
         # update king's location
         if move.pieceMoved == "wK":
-            self.white_king_location = (move.endRow, move.endCol)
+            self.white_king_location = boardSquares[endSquare]
         elif move.pieceMoved == "bK":
-            self.black_king_location = (move.endRow, move.endCol)
+            self.black_king_location = boardSquares[endSquare]
 
         # Check if king is captured (checkmate)
         if move.pieceCaptured == "wK":
@@ -56,38 +386,77 @@ class GameState():
             
         # castle move
         if move.isCastleMove:
+            rook = move.pieceMoved[0] + "R"
             if move.endCol - move.startCol == 2:  # king side castle
                 self.board[move.endRow][move.endCol-1] = self.board[move.endRow][move.endCol+1]  # moves the rook
                 self.board[move.endRow][move.endCol+1] = "--"  # erase old rook
+                own_squares.remove(boardSquares[endSquare + 1])
+                own_squares.add(boardSquares[endSquare - 1])
+                key ^= zobristPieces[rook][endSquare + 1] ^ zobristPieces[rook][endSquare - 1]
+                position += piecePositionValues[rook][endSquare - 1] - piecePositionValues[rook][endSquare + 1]
             else:  # queen side castle
                 self.board[move.endRow][move.endCol+1] = self.board[move.endRow][move.endCol-2]  # moves the rook
                 self.board[move.endRow][move.endCol-2] = "--"  # erase old rook
+                own_squares.remove(boardSquares[endSquare - 2])
+                own_squares.add(boardSquares[endSquare + 1])
+                key ^= zobristPieces[rook][endSquare - 2] ^ zobristPieces[rook][endSquare + 1]
+                position += piecePositionValues[rook][endSquare + 1] - piecePositionValues[rook][endSquare - 2]
                 
         # en passant
         if move.isEnpassantMove:
             self.board[move.startRow][move.endCol] = "--"
+            key ^= zobristPieces[move.pieceCaptured][move.startRow * 8 + move.endCol]
+            material -= pieceMaterial[move.pieceCaptured]
+            position -= piecePositionValues[move.pieceCaptured][move.startRow * 8 + move.endCol]
         # en passant move
         #if hasattr(move, "isEnpassantMove") and move.isEnpassantMove:
         #    self.board[move.startRow][move.endCol] = "--"  # bắt tốt
 
         if move.pieceMoved[1] == "P" and abs(move.startRow - move.endRow) == 2:
-            self.en_passant_possible = ((move.startRow + move.endRow)//2, move.startCol)
+            self.en_passant_possible = boardSquares[(startSquare + endSquare) // 2]
         else:
             self.en_passant_possible = ()
 
-        self.en_passant_log.append(self.en_passant_possible)
+        # move counters
+        if move.pieceMoved[1] == "P" or move.pieceCaptured != "--":
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if move.pieceMoved[0] == "b":
+            self.fullmove_number += 1
 
         # update castling rights
         self.updateCastleRights(move)
-        self.castle_rights_log.append(CastleRights(self.current_castling_rights.wks, self.current_castling_rights.bks,
-                                               self.current_castling_rights.wqs, self.current_castling_rights.bqs))
         
         #pawn promotion
         if move.isPawnPromotion:
             # Chỉ phong cấp nếu là tốt và đi đến hàng cuối
             if (move.pieceMoved == "wP" and move.endRow == 0) or (move.pieceMoved == "bP" and move.endRow == 7):
-                promoted_piece = move.promoteTo if hasattr(move, "promoteTo") and move.promoteTo else ("wQ" if self.white_to_move else "bQ")
+                # the side to move has already been switched, so take the colour from the pawn
+                promoted_piece = move.promoteTo if hasattr(move, "promoteTo") and move.promoteTo else move.pieceMoved[0] + "Q"
                 self.board[move.endRow][move.endCol] = promoted_piece
+                key ^= zobristPieces[move.pieceMoved][endSquare] ^ zobristPieces[promoted_piece][endSquare]
+                material += pieceMaterial[promoted_piece] - pieceMaterial[move.pieceMoved]
+                position += piecePositionValues[promoted_piece][endSquare] - moved_values[endSquare]
+
+        if self.bitboards is not None:
+            Chess_bitboard.toggleMove(self.bitboards, move, self.board[move.endRow][move.endCol])
+
+        # put the new side to move, castling rights and en passant file into the key
+        key ^= zobristCastle[self.current_castling_rights.bits()]
+        if self.en_passant_possible != ():
+            key ^= zobristEnPassant[self.en_passant_possible[1]]
+        if not self.white_to_move:
+            key ^= zobristBlackToMove
+        self.zobrist_key = key
+        self.material_score = material
+        self.position_score = position
+        if VERIFY_ZOBRIST:
+            self.verifyZobristKey()
+        if VERIFY_EVAL:
+            self.verifyEvalScores()
+        if VERIFY_PIECE_SQUARES:
+            self.verifyPieceSquares()
 
     # Undo the last move
     def undoMove(self):
@@ -96,46 +465,76 @@ class GameState():
         """
         if len(self.move_log) != 0:  # make sure that there is a move to undo
             move = self.move_log.pop()
+            if self.bitboards is not None:
+                Chess_bitboard.toggleMove(self.bitboards, move, self.board[move.endRow][move.endCol])
             self.board[move.startRow][move.startCol] = move.pieceMoved
             self.board[move.endRow][move.endCol] = move.pieceCaptured
             self.white_to_move = not self.white_to_move  # swap players
+            startSquare = move.startRow * 8 + move.startCol
+            endSquare = move.endRow * 8 + move.endCol
+            own_squares = self.piece_squares[move.pieceMoved[0]]
+            own_squares.remove(boardSquares[endSquare])
+            own_squares.add(boardSquares[startSquare])
+            if move.pieceCaptured != "--":
+                self.piece_squares[move.pieceCaptured[0]].add(
+                    boardSquares[move.startRow * 8 + move.endCol if move.isEnpassantMove else endSquare])
             
             # update the king's position if needed
             if move.pieceMoved == "wK":
-                self.white_king_location = (move.startRow, move.startCol)
+                self.white_king_location = boardSquares[startSquare]
             elif move.pieceMoved == "bK":
-                self.black_king_location = (move.startRow, move.startCol)
+                self.black_king_location = boardSquares[startSquare]
             
             # undo en passant move
             if move.isEnpassantMove:
                 self.board[move.endRow][move.endCol] = "--"  # leave landing square blank
                 self.board[move.startRow][move.endCol] = move.pieceCaptured  # restore captured pawn
             
-            # undo pawn promotion
-            if move.isPawnPromotion:
-                self.board[move.startRow][move.endCol] = move.pieceCaptured  # restore original pawn
+            # undo pawn promotion: the pawn and the captured piece were already put back above
             
             # undo castle move
             if move.isCastleMove:
                 if move.endCol - move.startCol == 2:  # king-side
                     self.board[move.endRow][move.endCol + 1] = self.board[move.endRow][move.endCol - 1]
                     self.board[move.endRow][move.endCol - 1] = "--"
+                    own_squares.remove(boardSquares[endSquare - 1])
+                    own_squares.add(boardSquares[endSquare + 1])
                 else:  # queen-side
                     self.board[move.endRow][move.endCol - 2] = self.board[move.endRow][move.endCol + 1]
                     self.board[move.endRow][move.endCol + 1] = "--"
+                    own_squares.remove(boardSquares[endSquare + 1])
+                    own_squares.add(boardSquares[endSquare - 2])
             
-            # restore en passant possible
-            self.en_passant_log.pop()
-            self.en_passant_possible = self.en_passant_log[-1]
-            
-            # restore castling rights
-            self.castle_rights_log.pop()
-            self.current_castling_rights = self.castle_rights_log[-1]
+            # restore castling rights, en passant, the halfmove clock, the Zobrist key and the scores
+            self.ply -= 1
+            stack = self.undo_stack
+            i = self.ply * UNDO_STRIDE
+            state = stack[i]
+            self.current_castling_rights.setBits(state & 15)
+            # the pawn that could be taken en passant was the other side's, on the 6th rank of the side to move
+            en_passant_file = state >> 4
+            if en_passant_file:
+                self.en_passant_possible = boardSquares[(16 if self.white_to_move else 40) + en_passant_file - 1]
+            else:
+                self.en_passant_possible = ()
+            self.halfmove_clock = stack[i + 1]
+            self.zobrist_key = stack[i + 2]
+            self.material_score = stack[i + 3]
+            self.position_score = stack[i + 4]
+            if move.pieceMoved[0] == "b":
+                self.fullmove_number -= 1
             
             # reset checkmate and stalemate
             self.checkmate = False
             self.stalemate = False
 
+            if VERIFY_ZOBRIST:
+                self.verifyZobristKey()
+            if VERIFY_EVAL:
+                self.verifyEvalScores()
+            if VERIFY_PIECE_SQUARES:
+                self.verifyPieceSquares()
+
     def updateCastleRights(self, move):
         if move.pieceMoved == "wK":
             self.current_castling_rights.wks = False
@@ -155,10 +554,23 @@ class GameState():
                     self.current_castling_rights.bqs = False
                 elif move.startCol == 7: # right rook
                     self.current_castling_rights.bks = False
+        # a rook captured on its starting square takes its castling right with it
+        if move.pieceCaptured == "wR" and move.endRow == 7:
+            if move.endCol == 0:
+                self.current_castling_rights.wqs = False
+            elif move.endCol == 7:
+                self.current_castling_rights.wks = False
+        elif move.pieceCaptured == "bR" and move.endRow == 0:
+            if move.endCol == 0:
+                self.current_castling_rights.bqs = False
+            elif move.endCol == 7:
+                self.current_castling_rights.bks = False
                     
 
     # All moves considering checks
     def getValidMoves(self):
+        if self.bitboards is not None:
+            return Chess_bitboard.getValidMoves(self)
         moves = []
         self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
 
@@ -171,28 +583,8 @@ class GameState():
 
         if self.inCheck:
             if len(self.checks) == 1:  # chỉ 1 quân chiếu -> chặn hoặc di chuyển vua
-                moves = self.getAllPossibleMoves()
-                check = self.checks[0]
-                checkRow = check[0]
-                checkCol = check[1]
-                pieceChecking = self.board[checkRow][checkCol]
-                validSquares = []  # các ô có thể di chuyển tới
-
-                if pieceChecking[1] == "N":  # nếu bị mã chiếu -> phải bắt mã hoặc di chuyển vua
-                    validSquares = [(checkRow, checkCol)]
-                else:
-                    for i in range(1, 8):
-                        validSquare = (kingRow + check[2] * i,
-                                       kingCol + check[3] * i)
-                        validSquares.append(validSquare)
-                        if validSquare[0] == checkRow and validSquare[1] == checkCol:
-                            break
-
-                # xóa các nước đi không chặn được chiếu hoặc di chuyển vua
-                for i in range(len(moves) - 1, -1, -1):
-                    if moves[i].pieceMoved[1] != "K":  # không phải di chuyển vua
-                        if not (moves[i].endRow, moves[i].endCol) in validSquares:
-                            moves.remove(moves[i])
+                self.getKingMoves(kingRow, kingCol, moves)
+                self.getEvasionMoves(kingRow, kingCol, moves)
             else:  # bị chiếu kép -> phải di chuyển vua
                 self.getKingMoves(kingRow, kingCol, moves)
         else:  # không bị chiếu -> tất cả nước đi đều hợp lệ
@@ -214,6 +606,52 @@ class GameState():
 
         return moves
 
+    def getEvasionMoves(self, kingRow, kingCol, moves):
+        """
+        Moves of the pieces other than the king out of a single check: capture the checker or block the ray.
+        Instead of generating every move and dropping the others, look outward from each square that resolves
+        the check for the pieces that can reach it. A pinned piece never can, it stays on its pin line.
+        """
+        board = self.board
+        checkRow, checkCol, checkRowDir, checkColDir = self.checks[0]
+        ally_color = 'w' if self.white_to_move else 'b'
+        pawn = ally_color + 'P'
+        move_amount = -1 if self.white_to_move else 1
+        pinned = {(pin[0], pin[1]) for pin in self.pins}
+        # the checker's square, then the empty squares between it and the king unless it is a knight
+        targets = [(checkRow, checkCol)]
+        if board[checkRow][checkCol][1] != 'N':
+            row, col = kingRow + checkRowDir, kingCol + checkColDir
+            while (row, col) != (checkRow, checkCol):
+                targets.append((row, col))
+                row += checkRowDir
+                col += checkColDir
+        for target in targets:
+            for start in self.attackers_of(target, ally_color):
+                if start in pinned:
+                    continue
+                piece = board[start[0]][start[1]][1]
+                if piece == 'P':
+                    if target == targets[0]:  # pawns only move diagonally to capture
+                        addPawnMove(moves, start, target, board)
+                elif piece != 'K':  # the king's own moves are generated separately
+                    moves.append(Move(start, target, board))
+            if target != targets[0]:
+                # blocking pawn pushes, one square or two from the start rank
+                row, col = target
+                start = (row - move_amount, col)
+                if 0 <= start[0] <= 7 and board[start[0]][col] == pawn and start not in pinned:
+                    addPawnMove(moves, start, target, board)
+                elif row == (4 if self.white_to_move else 3) and board[start[0]][col] == "--" and \
+                        board[start[0] - move_amount][col] == pawn and (start[0] - move_amount, col) not in pinned:
+                    moves.append(Move((start[0] - move_amount, col), target, board))
+        # a checking pawn that has just advanced two squares can also be taken en passant
+        if board[checkRow][checkCol][1] == 'P' and self.en_passant_possible == (checkRow + move_amount, checkCol):
+            for col in (checkCol - 1, checkCol + 1):
+                if 0 <= col <= 7 and board[checkRow][col] == pawn and (checkRow, col) not in pinned and \
+                        self.isEnpassantLegal(checkRow, col, checkCol):
+                    moves.append(Move((checkRow, col), (checkRow + move_amount, checkCol), board, isEnpassantMove=True))
+
     def inCheck(self):
 
         if self.white_to_move:
@@ -223,119 +661,213 @@ class GameState():
 
     # Determine if the enemy can attack the square r,c
     def squaredUnderAttack(self, r, c):
-        self.white_to_move = not self.white_to_move  # switch to opponent's move
-        # Get all possible moves for the opponent
-        moves = []
-        for row in range(len(self.board)):
-            for col in range(len(self.board[row])):
-                turn = self.board[row][col][0]
-                if (turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.board[row][col][1]
-                    if piece != 'K':  # Skip king moves to avoid recursion
-                        self.moveFunctions[piece](row, col, moves)
-        self.white_to_move = not self.white_to_move  # switch turn back
-        for move in moves:
-            if move.endRow == r and move.endCol == c:  # square is under attack
-                return True
-        return False
+        enemy_color = 'b' if self.white_to_move else 'w'
+        if self.bitboards is not None:
+            return Chess_bitboard.isSquareAttacked(self, r, c, enemy_color)
+        return len(self.attackers_of((r, c), enemy_color, first_only=True)) > 0
+
+    def attackers_of(self, square, color, first_only=False, empty=None):
+        """
+        Squares of the pieces of the given colour that attack square, found by looking outward from it
+        along the rays, the knight jumps, the pawn diagonals and the adjacent squares.
+        With first_only the scan stops at the first attacker. The rays see through the square empty,
+        e.g. the king's own square when testing where it can go.
+        """
+        if self.bitboards is not None:
+            return Chess_bitboard.attackersOf(self, square, color, first_only, empty)
+        row, col = square
+        attackers = []
+        # a pawn attacks diagonally forward, so look one row behind it: below the square for white pawns
+        pawn_row = 1 if color == 'w' else -1
+        for j, d in enumerate(attackDirections):
+            end_row = row + d[0]
+            end_col = col + d[1]
+            distance = 1
+            while 0 <= end_row <= 7 and 0 <= end_col <= 7:
+                piece = self.board[end_row][end_col]
+                if piece != "--" and (end_row, end_col) != empty:
+                    if piece[0] == color:
+                        kind = piece[1]
+                        if kind == 'Q' or (kind == 'R' and j < 4) or (kind == 'B' and j >= 4) or \
+                                (distance == 1 and (kind == 'K' or (kind == 'P' and j >= 4 and d[0] == pawn_row))):
+                            attackers.append((end_row, end_col))
+                            if first_only:
+                                return attackers
+                    break
+                end_row += d[0]
+                end_col += d[1]
+                distance += 1
+        for d in knightJumps:
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7 and self.board[end_row][end_col] == color + 'N':
+                attackers.append((end_row, end_col))
+                if first_only:
+                    return attackers
+        return attackers
     
     # All moves without considering checks
     def getAllPossibleMoves(self):
         moves = []
-        for r in range(len(self.board)): # number of rows
-            for c in range(len(self.board[r])): # number of cols in given row
-                turn = self.board[r][c][0]
-                if(turn == 'w' and self.white_to_move) or (turn == 'b' and not self.white_to_move):
-                    piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves) # calls the appropriate move function base on piece type
+        board = self.board
+        moveFunctions = self.moveFunctions
+        # only the squares of the side to move, sorted so the moves come out in board order
+        for r, c in sorted(self.piece_squares['w' if self.white_to_move else 'b']):
+            moveFunctions[board[r][c][1]](r, c, moves) # calls the appropriate move function base on piece type
+        return moves
+
+    # Captures only, for the quiescence search
+    def getCaptureMoves(self):
+        """
+        Legal captures and promotions of the side to move, without generating the quiet moves.
+        In check every evasion is returned instead (self.inCheck is set either way), because
+        looking at captures alone would miss the legal replies.
+        """
+        if self.bitboards is not None:
+            return Chess_bitboard.getCaptureMoves(self)
+        self.inCheck, self.pins, self.checks = self.checkForPinsAndChecks()
+        if self.inCheck:
+            return self.getValidMoves()
+        moves = []
+        board = self.board
+        captureFunctions = self.captureFunctions
+        for r, c in sorted(self.piece_squares['w' if self.white_to_move else 'b']):
+            captureFunctions[board[r][c][1]](r, c, moves)
         return moves
 
+    def getPinDirection(self, row, col):
+        """
+        Direction of the pin on the piece at row, col (seen from the king), or None if it isn't pinned
+        """
+        for pin in self.pins:
+            if pin[0] == row and pin[1] == col:
+                return (pin[2], pin[3])
+        return None
+
+    def getPawnCaptures(self, row, col, moves):
+        pin_direction = self.getPinDirection(row, col)
+        if self.white_to_move:
+            move_amount = -1
+            enemy_color = "b"
+        else:
+            move_amount = 1
+            enemy_color = "w"
+        end_row = row + move_amount
+        if (end_row == 0 or end_row == 7) and self.board[end_row][col] == "--":  # promotion push
+            if pin_direction is None or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
+                addPawnMove(moves, (row, col), (end_row, col), self.board)
+        for d in (-1, 1):
+            end_col = col + d
+            if 0 <= end_col <= 7 and (pin_direction is None or pin_direction == (move_amount, d)):
+                if self.board[end_row][end_col][0] == enemy_color:
+                    addPawnMove(moves, (row, col), (end_row, end_col), self.board)
+                elif (end_row, end_col) == self.en_passant_possible and self.isEnpassantLegal(row, col, end_col):
+                    moves.append(Move((row, col), (end_row, end_col), self.board, isEnpassantMove=True))
+
+    def getSlidingCaptures(self, r, c, directions, moves):
+        pin_direction = self.getPinDirection(r, c)
+        enemyColor = 'b' if self.white_to_move else 'w'
+        for d in directions:
+            if pin_direction is not None and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue  # moving off the pin line would expose the king
+            endRow = r + d[0]
+            endCol = c + d[1]
+            while 0 <= endRow < 8 and 0 <= endCol < 8:
+                endPiece = self.board[endRow][endCol]
+                if endPiece != '--':
+                    if endPiece[0] == enemyColor:
+                        moves.append(Move((r, c), (endRow, endCol), self.board))
+                    break
+                endRow += d[0]
+                endCol += d[1]
+
+    def getRockCaptures(self, r, c, moves):
+        self.getSlidingCaptures(r, c, ((-1, 0), (0, -1), (1, 0), (0, 1)), moves)
+
+    def getBishopCaptures(self, r, c, moves):
+        self.getSlidingCaptures(r, c, ((-1, -1), (-1, 1), (1, -1), (1, 1)), moves)
+
+    def getQueenCaptures(self, r, c, moves):
+        self.getSlidingCaptures(r, c, ((-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)), moves)
+
+    def getKnightCaptures(self, r, c, moves):
+        if self.getPinDirection(r, c) is not None:
+            return  # a pinned knight can never move
+        enemyColor = 'b' if self.white_to_move else 'w'
+        for m in ((-2, 1), (-2, -1), (-1, -2), (1, -2), (1, 2), (2, 1), (2, -1), (-1, 2)):
+            endRow = r + m[0]
+            endCol = c + m[1]
+            if 0 <= endRow < 8 and 0 <= endCol < 8 and self.board[endRow][endCol][0] == enemyColor:
+                moves.append(Move((r, c), (endRow, endCol), self.board))
+
+    def getKingCaptures(self, row, col, moves):
+        enemy_color = "b" if self.white_to_move else "w"
+        for d in ((-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)):
+            end_row = row + d[0]
+            end_col = col + d[1]
+            if 0 <= end_row <= 7 and 0 <= end_col <= 7 and self.board[end_row][end_col][0] == enemy_color:
+                # the king's square counts as empty, a slider checking along the line also covers the squares behind it
+                if not self.attackers_of((end_row, end_col), enemy_color, True, (row, col)):
+                    moves.append(Move((row, col), (end_row, end_col), self.board))
+
     def getPawnMoves(self, row, col, moves):
         """
         Get all the pawn moves for the pawn located at row, col and add the moves to the list.
         """
-        piece_pinned = False
-        pin_direction = ()
-        for i in range(len(self.pins) - 1, -1, -1):
-            if self.pins[i][0] == row and self.pins[i][1] == col:
-                piece_pinned = True
-                pin_direction = (self.pins[i][2], self.pins[i][3])
-                self.pins.remove(self.pins[i])
-                break
+        pin_direction = self.getPinDirection(row, col)
+        piece_pinned = pin_direction is not None
 
         if self.white_to_move:
             move_amount = -1
             start_row = 6
             enemy_color = "b"
-            king_row, king_col = self.white_king_location
         else:
             move_amount = 1
             start_row = 1
             enemy_color = "w"
-            king_row, king_col = self.black_king_location
 
         if self.board[row + move_amount][col] == "--":  # 1 square pawn advance
-            if not piece_pinned or pin_direction == (move_amount, 0):
-                moves.append(Move((row, col), (row + move_amount, col), self.board))
+            if not piece_pinned or pin_direction == (move_amount, 0) or pin_direction == (-move_amount, 0):
+                addPawnMove(moves, (row, col), (row + move_amount, col), self.board)
                 if row == start_row and self.board[row + 2 * move_amount][col] == "--":  # 2 square pawn advance
                     moves.append(Move((row, col), (row + 2 * move_amount, col), self.board))
         if col - 1 >= 0:  # capture to the left
             if not piece_pinned or pin_direction == (move_amount, -1):
                 if self.board[row + move_amount][col - 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board))
-                if (row + move_amount, col - 1) == self.en_passant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col - 1)
-                            outside_range = range(col + 1, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col, -1)
-                            outside_range = range(col - 2, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col - 1), self.board, isEnpassantMove=True))
+                    addPawnMove(moves, (row, col), (row + move_amount, col - 1), self.board)
+                if (row + move_amount, col - 1) == self.en_passant_possible and self.isEnpassantLegal(row, col, col - 1):
+                    moves.append(Move((row, col), (row + move_amount, col - 1), self.board, isEnpassantMove=True))
         if col + 1 <= 7:  # capture to the right
             if not piece_pinned or pin_direction == (move_amount, +1):
                 if self.board[row + move_amount][col + 1][0] == enemy_color:
-                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board))
-                if (row + move_amount, col + 1) == self.en_passant_possible:
-                    attacking_piece = blocking_piece = False
-                    if king_row == row:
-                        if king_col < col:  # king is left of the pawn
-                            # inside: between king and the pawn;
-                            # outside: between pawn and border;
-                            inside_range = range(king_col + 1, col)
-                            outside_range = range(col + 2, 8)
-                        else:  # king right of the pawn
-                            inside_range = range(king_col - 1, col + 1, -1)
-                            outside_range = range(col - 1, -1, -1)
-                        for i in inside_range:
-                            if self.board[row][i] != "--":  # some piece beside en-passant pawn blocks
-                                blocking_piece = True
-                        for i in outside_range:
-                            square = self.board[row][i]
-                            if square[0] == enemy_color and (square[1] == "R" or square[1] == "Q"):
-                                attacking_piece = True
-                            elif square != "--":
-                                blocking_piece = True
-                    if not attacking_piece or blocking_piece:
-                        moves.append(Move((row, col), (row + move_amount, col + 1), self.board, isEnpassantMove=True))
+                    addPawnMove(moves, (row, col), (row + move_amount, col + 1), self.board)
+                if (row + move_amount, col + 1) == self.en_passant_possible and self.isEnpassantLegal(row, col, col + 1):
+                    moves.append(Move((row, col), (row + move_amount, col + 1), self.board, isEnpassantMove=True))
+
+    def isEnpassantLegal(self, row, col, capture_col):
+        """
+        Check that the pawn at row, col taking en passant on capture_col doesn't leave its own king in check.
+        Both pawns leave the rank at once, which the pin scan can't see, so play the capture on the board and look.
+        """
+        pawn = self.board[row][col]
+        captured = self.board[row][capture_col]
+        end_row = row + (-1 if pawn[0] == "w" else 1)
+        self.board[row][col] = "--"
+        self.board[row][capture_col] = "--"
+        self.board[end_row][capture_col] = pawn
+        in_check = self.checkForPinsAndChecks()[0]
+        self.board[end_row][capture_col] = "--"
+        self.board[row][capture_col] = captured
+        self.board[row][col] = pawn
+        return not in_check
 
     def getRockMoves(self,r,c,moves):
         directions = ((-1,0),(0,-1),(1,0),(0,1)) # up, down ,left, right
         enemyColor = 'b' if self.white_to_move else 'w'
+        pin_direction = self.getPinDirection(r, c)
         for d in directions:
+            if pin_direction is not None and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue  # a pinned piece can only slide along the pin line
             for i in range(1,8):
                 endRow = r + d[0] * i
                 endCol = c +d[1] * i
@@ -354,7 +886,10 @@ class GameState():
     def getBishopMoves(self,r,c,moves):
         directions = ((-1,-1),(-1,1),(1,-1),(1,1))
         enemyColor = 'b' if self.white_to_move else 'w'
+        pin_direction = self.getPinDirection(r, c)
         for d in directions:
+            if pin_direction is not None and pin_direction != d and pin_direction != (-d[0], -d[1]):
+                continue  # a pinned piece can only slide along the pin line
             for i in range(1,8): # Bishop can move maximum 7 squares
                 endRow = r + d[0] * i
                 endCol = c +d[1] * i
@@ -371,6 +906,8 @@ class GameState():
                     break
 
     def getKnightMoves(self, r, c, moves):
+        if self.getPinDirection(r, c) is not None:
+            return  # a pinned knight can never move
         knightMoves = ((-2,1),(-2,-1),(-1,-2),(1,-2),(1,2),(2,1),(2,-1),(-1,2))
         allyColor = 'w' if self.white_to_move else 'b'
         for m in knightMoves:
@@ -392,26 +929,17 @@ class GameState():
         row_moves = (-1, -1, -1, 0, 0, 1, 1, 1)
         col_moves = (-1, 0, 1, -1, 1, -1, 0, 1)
         ally_color = "w" if self.white_to_move else "b"
+        enemy_color = "b" if self.white_to_move else "w"
         for i in range(8):
             end_row = row + row_moves[i]
             end_col = col + col_moves[i]
             if 0 <= end_row <= 7 and 0 <= end_col <= 7:  # check if move is on board
                 end_piece = self.board[end_row][end_col]
                 if end_piece[0] != ally_color:  # not an ally piece - empty or enemy
-                    # place king on end square and check for checks
-                    if ally_color == "w":
-                        self.white_king_location = (end_row, end_col)
-                    else:
-                        self.black_king_location = (end_row, end_col)
-                    in_check, pins, checks = self.checkForPinsAndChecks()
-                    if not in_check:
+                    # is the end square attacked, looking through the king's square as if it had already left
+                    if not self.attackers_of((end_row, end_col), enemy_color, True, (row, col)):
                         moves.append(Move((row, col), (end_row, end_col), self.board))
-                    # place king back on original location
-                    if ally_color == "w":
-                        self.white_king_location = (row, col)
-                    else:
-                        self.black_king_location = (row, col)
-        self.getCastleMoves(row, col, moves)
+        # castling is added once by getValidMoves
     '''
     get all valid castle moves for the king (r,c) and add them to the list of moves
     '''
@@ -536,15 +1064,50 @@ class GameState():
 
         return inCheck, pins, checks
 
+promotionPieces = ("Q", "R", "B", "N")
+
+
+def addPawnMove(moves, start_square, end_square, board):
+    """
+    Add a pawn move, or one move per promotion piece when the pawn reaches the last rank
+    """
+    if end_square[0] == 0 or end_square[0] == 7:
+        color = board[start_square[0]][start_square[1]][0]
+        for piece in promotionPieces:
+            moves.append(Move(start_square, end_square, board, promoteTo=color + piece))
+    else:
+        moves.append(Move(start_square, end_square, board))
+
+
 class CastleRights():
     def __init__(self, wks, bks, wqs, bqs):
         self.wks = wks
         self.bks = bks
         self.wqs = wqs
         self.bqs = bqs
+
+    def bits(self):
+        """
+        Castling rights packed into 4 bits: wks = 1, wqs = 2, bks = 4, bqs = 8
+        """
+        return (1 if self.wks else 0) | (2 if self.wqs else 0) | (4 if self.bks else 0) | (8 if self.bqs else 0)
+
+    def setBits(self, bits):
+        """
+        Set the rights from the packed form of bits()
+        """
+        self.wks = bits & 1 != 0
+        self.wqs = bits & 2 != 0
+        self.bks = bits & 4 != 0
+        self.bqs = bits & 8 != 0
         
 
 class Move():
+    # No per-instance __dict__: thousands of moves are made for every getValidMoves call during a search,
+    # and callers can't hang ad-hoc attributes on them (the GUI keeps its own per-move data)
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured", "isPawnPromotion",
+                 "moveID", "isCastleMove", "isEnpassantMove", "promoteTo", "isCapture")
+
     # maps key to values
     # key: value
     ranksToRows = {
@@ -573,26 +1136,31 @@ class Move():
     colsToFiles ={v: k for k, v in filesToCols.items()}
 
     def __init__(self, start_square, end_square, board, isCastleMove=False, isEnpassantMove=False, promoteTo=None):
-        self.startRow = start_square[0]
-        self.startCol = start_square[1]
-        self.endRow = end_square[0]
-        self.endCol = end_square[1]
-        self.pieceMoved = board[self.startRow][self.startCol]
-        self.pieceCaptured = board[self.endRow][self.endCol]
-        self.isPawnPromotion = False
-        if (self.pieceMoved == "wP" and self.endRow == 0) or (self.pieceMoved == "bP" and self.endRow == 7):
-            self.isPawnPromotion = True
-        self.moveID = self.startRow * 1000 + self.startCol * 100 + self.endRow * 10 + self.endCol
+        # locals instead of reading the attributes back, this runs for every generated move
+        startRow, startCol = start_square
+        endRow, endCol = end_square
+        pieceMoved = board[startRow][startCol]
+        pieceCaptured = board[endRow][endCol]
+        self.startRow = startRow
+        self.startCol = startCol
+        self.endRow = endRow
+        self.endCol = endCol
+        self.pieceMoved = pieceMoved
+        self.isPawnPromotion = (pieceMoved == "wP" and endRow == 0) or (pieceMoved == "bP" and endRow == 7)
+        moveID = startRow * 1000 + startCol * 100 + endRow * 10 + endCol
         # castle move
         self.isCastleMove = isCastleMove
         # en passant
         self.isEnpassantMove = isEnpassantMove
-        if self.isEnpassantMove:
-            self.pieceCaptured = "bP" if self.pieceMoved == "wP" else "wP"
+        if isEnpassantMove:
+            pieceCaptured = "bP" if pieceMoved == "wP" else "wP"
+        self.pieceCaptured = pieceCaptured
         # pawn promotion
         self.promoteTo = promoteTo
-
-        self.isCapture = (self.pieceCaptured != "--")
+        if promoteTo:
+            moveID += 10000 * (promotionPieces.index(promoteTo[1]) + 1)
+        self.moveID = moveID
+        self.isCapture = pieceCaptured != "--"
     # Overriding the equals method
     def __eq__(self, other):
         if isinstance(other, Move):
@@ -604,7 +1172,7 @@ class Move():
     def getChessNotation(self):
         #return self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
         if self.isPawnPromotion:
-            return self.getRankFile(self.endRow, self.endCol) + "Q"
+            return self.getRankFile(self.endRow, self.endCol) + (self.promoteTo[1] if self.promoteTo else "Q")
         if self.isCastleMove:
             if self.endCol == 1:
                 return "0-0-0"
@@ -628,6 +1196,15 @@ class Move():
     def getRankFile(self,r,c):
         return self.colsToFiles[c] +self.rowsToRanks[r]
 
+    def getUciNotation(self):
+        """
+        Long algebraic notation as used by UCI: start and end square plus the promotion piece, e.g. e7e8q
+        """
+        notation = self.getRankFile(self.startRow, self.startCol) + self.getRankFile(self.endRow, self.endCol)
+        if self.isPawnPromotion:
+            notation += (self.promoteTo[1] if self.promoteTo else "Q").lower()
+        return notation
+
     def __str__(self):
         if self.isCastleMove:
             return "0-0" if self.endCol == 6 else "0-0-0"
@@ -638,10 +1215,41 @@ class Move():
             if self.isCapture:
                 return self.colsToFiles[self.startCol] + "x" + end_square
             else:
-                return end_square + "Q" if self.isPawnPromotion else end_square
+                return end_square + (self.promoteTo[1] if self.promoteTo else "Q") if self.isPawnPromotion else end_square
 
         move_string = self.pieceMoved[1]
         if self.isCapture:
             move_string += "x"
         return move_string + end_square
 
+
+def parseEpdOperations(text):
+    """
+    EPD operations such as 'bm e4; id "test 1";' as a dict of opcode to operand string
+    """
+    operations = {}
+    for operation in text.split(";"):
+        operation = operation.strip()
+        if operation:
+            opcode, _, operand = operation.partition(" ")
+            operations[opcode] = operand.strip().strip('"')
+    return operations
+
+
+def readPositions(path, backend="mailbox"):
+    """
+    Yield (GameState, EPD operations) for every FEN or EPD line of a file, reading one line at a time
+    so files with many positions are never held in memory. Blank lines and lines starting with # are skipped.
+    """
+    with open(path) as positions:
+        for line in positions:
+            line = line.strip()
+            if not line or line[0] == "#":
+                continue
+            fields = line.split(None, 6)
+            if len(fields) >= 6 and fields[4].isdigit() and fields[5].isdigit():
+                fen, rest = " ".join(fields[:6]), " ".join(fields[6:])
+            else:
+                fields = line.split(None, 4)
+                fen, rest = " ".join(fields[:4]), " ".join(fields[4:])
+            yield GameState.from_fen(fen, backend), parseEpdOperations(rest)
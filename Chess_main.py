@@ -1,9 +1,7 @@
 # Updated Chess_main.py with scrollable history and improved scoring
 
 import pygame as p
-import Chess_engine, Chess_AI
-from multiprocessing import Queue, Process
-from queue import Empty
+import Chess_engine, Chess_AI, Chess_worker
 import random
 
 import time
@@ -15,9 +13,18 @@ MAX_FPS = 15
 IMAGES = {}
 colors = [p.Color("white"), p.Color("#B58863")]
 BOARD_WIDTH = WIDTH
+PONDER = True  # let the AI think on the player's time
 MOVE_LOG_PANEL_WIDTH = 250
 
 scroll_offset = 0  # Global scroll offset
+move_scores = []  # material score before every move of gs.move_log, for the history popup
+
+def record_move_score(gs):
+    """
+    Call before gs.makeMove: drops the scores of undone moves and adds the one of the move about to be made
+    """
+    del move_scores[len(gs.move_log):]
+    move_scores.append(Chess_AI.scoreMaterial(gs.board))
 
 def load_images():
     pieces = ['wP', 'wR', 'wN', 'wB', 'wQ', 'wK',
@@ -222,6 +229,7 @@ def draw_popup(screen, message, button_text="OK", icon=None):
 def main():
     p.init()
     screen = p.display.set_mode((WIDTH, HEIGHT))  # Menu chỉ cần kích thước bàn cờ
+    p.display.set_caption("Chess")
     clock = p.time.Clock()
 
     # Define colors
@@ -253,7 +261,8 @@ def main():
     player_clicks = []
     AI_thinking = False
     moveUndone = False
-    moveFinderProcess = None
+    engine = Chess_worker.EngineWorker()
+    shown_progress = None  # search progress shown in the window title
 
     load_images()
     running = True
@@ -361,8 +370,13 @@ def main():
                                                             promoting = False
                                                             break
                                             p.time.wait(10)
-                                        move_to_make.promoteTo = promoteTo
-                                    move_to_make.score = Chess_AI.scoreMaterial(gs.board)
+                                        # the generated move for the chosen piece, its moveID includes the promotion
+                                        for valid_move in valid_moves:
+                                            if valid_move.moveID % 10000 == move_to_make.moveID % 10000 and \
+                                               valid_move.promoteTo == promoteTo:
+                                                move_to_make = valid_move
+                                                break
+                                    record_move_score(gs)
                                     gs.makeMove(move_to_make)
                                     moveMade = True
                                 square_selected = ()
@@ -373,9 +387,8 @@ def main():
                         gs.undoMove()
                         moveMade = True
                         game_over = False
-                        if AI_thinking:
-                            AI_thinking = False
-                            moveFinderProcess.terminate()
+                        AI_thinking = False
+                        engine.stop()  # also ends pondering
                         moveUndone = False
                         player_clicks = []
                         square_selected = ()
@@ -388,9 +401,11 @@ def main():
                         game_over = False
                         if AI_thinking:
                             AI_thinking = False
-                            moveFinderProcess.terminate()
+                        engine.newGame()
                         moveUndone = False
                         scroll_offset = 0
+                    if e.key == p.K_SPACE and AI_thinking:
+                        engine.moveNow()  # play the best move found so far
                     if game_over and e.key == p.K_h and (p.key.get_mods() & p.KMOD_CTRL):
                         show_history_popup = True
                     if show_history_popup:
@@ -409,26 +424,35 @@ def main():
                 if not AI_thinking:
                     AI_thinking = True
                     print("thinking ... ")
-                    returnQueue = Queue()
-                    moveFinderProcess = Process(target=Chess_AI.findBestMove, args=(gs, valid_moves, returnQueue))
-                    moveFinderProcess.start()
-
-                if moveFinderProcess is not None and not moveFinderProcess.is_alive():
+                    # the worker only replays the moves it hasn't seen yet
+                    engine.startSearch(Chess_engine.START_FEN, [move.getUciNotation() for move in gs.move_log])
+
+                done, AI_notation = engine.poll()
+                if engine.progress is not None and engine.progress is not shown_progress:
+                    shown_progress = engine.progress
+                    score = shown_progress["score"] if gs.white_to_move else -shown_progress["score"]
+                    p.display.set_caption("Thinking: depth %d, best %s, score %+.2f, %d nodes" %
+                                          (shown_progress["depth"], shown_progress["move"], score, shown_progress["nodes"]))
+                if done:
                     print("done thinking")
-                    try:
-                        AI_move = returnQueue.get()
-                        if AI_move is None:
-                            AI_move = Chess_AI.findRandomMoves(valid_moves)
-                        AI_move.score = Chess_AI.scoreMaterial(gs.board)
-                        gs.makeMove(AI_move)
-                        moveMade = True
-                        AI_thinking = False
-                    except Empty:
-                        AI_move = Chess_AI.findRandomMoves(valid_moves)
-                        AI_move.score = Chess_AI.scoreMaterial(gs.board)
-                        gs.makeMove(AI_move)
-                        moveMade = True
-                        AI_thinking = False
+                    AI_move = None
+                    for move in valid_moves:
+                        if move.getUciNotation() == AI_notation:
+                            AI_move = move
+                            break
+                    if AI_move is None:
+                        # the first iteration always finishes, so the worker searched another position
+                        raise RuntimeError("engine returned %s, not a legal move in %s" % (AI_notation, gs.to_fen()))
+                    record_move_score(gs)
+                    gs.makeMove(AI_move)
+                    moveMade = True
+                    AI_thinking = False
+                    if PONDER and is_human_vs_computer:
+                        engine.startPonder(Chess_engine.START_FEN, [move.getUciNotation() for move in gs.move_log])
+
+            if not AI_thinking and shown_progress is not None:
+                shown_progress = None
+                p.display.set_caption("Chess")
 
             if moveMade:
                 valid_moves = gs.getValidMoves()
@@ -446,6 +470,8 @@ def main():
                     game_over = True
                     game_over_message = "Stalemate"
                     current_state = GAME_OVER
+                if game_over:
+                    engine.stop()  # nothing left to ponder
 
             p.display.flip()
             clock.tick(MAX_FPS)
@@ -468,11 +494,12 @@ def main():
                         game_over = False
                         if AI_thinking:
                             AI_thinking = False
-                            moveFinderProcess.terminate()
+                        engine.newGame()
                         moveUndone = False
                         scroll_offset = 0
                         current_state = MAIN_MENU
 
+    engine.quit()
     p.quit()
 
 def draw_text(screen, text):
@@ -568,7 +595,7 @@ def draw_history_popup(screen, gs, scroll_offset):
         turn = str(idx//2 + 1) if idx % 2 == 0 else ""
         side = "White" if idx % 2 == 0 else "Black"
         move_str = move.pieceMoved[1] + " " + move.getRankFile(move.startRow, move.startCol) + move.getRankFile(move.endRow, move.endCol)
-        score = getattr(move, 'score', 0)
+        score = move_scores[idx] if idx < len(move_scores) else 0
         row_y = 140 + i * 30
         bg_color = p.Color("#F0F0F0") if i % 2 == 0 else p.Color("#E0E0E0")
         p.draw.rect(screen, bg_color, p.Rect(60, row_y - 2, 460, 28))
@@ -577,8 +604,9 @@ def draw_history_popup(screen, gs, scroll_offset):
         screen.blit(font.render(move_str, True, p.Color("black")), (230, row_y))
         screen.blit(font.render(str(score), True, p.Color("black")), (420, row_y))
 
-    white_score = sum(m.score for i, m in enumerate(gs.move_log) if i % 2 == 0 and hasattr(m, 'score'))
-    black_score = sum(m.score for i, m in enumerate(gs.move_log) if i % 2 == 1 and hasattr(m, 'score'))
+    scores = move_scores[:len(gs.move_log)]
+    white_score = sum(scores[0::2])
+    black_score = sum(scores[1::2])
     footer_font = p.font.SysFont("Arial", 22, True)
     screen.blit(footer_font.render(f"Total White: {white_score}", True, p.Color("blue")), (60, 530))
     screen.blit(footer_font.render(f"Total Black: {black_score}", True, p.Color("red")), (300, 530))
@@ -0,0 +1,366 @@
+# Headless self-play match between two engine configurations, to tell whether a change to Chess_AI makes
+# it stronger or just slower. Games are played in parallel over a process pool from varied openings,
+# each opening once with each colour, and written to a PGN file as they finish.
+#
+#   python Chess_match.py --engine1 nodes=20000 --engine2 nodes=40000 --games 40
+#   python Chess_match.py --engine1 depth=3 --engine2 depth=3,ROOT_TIE_MARGIN=0 --workers 4 --pgn tie.pgn
+#
+# An engine configuration is a comma separated list of key=value: time (seconds per move), nodes and depth
+# are the search limits, name is the PGN name, TT_SIZE and SEARCH_STATS set up the engine's Searcher,
+# and the Chess_AI names in SEARCH_OVERRIDES (e.g. CHECK_EVERY) are set for that engine's searches.
+
+import argparse
+import math
+import os
+import sys
+import time
+from multiprocessing import Pool
+
+import Chess_engine, Chess_AI
+
+START_FEN = Chess_engine.START_FEN
+MAX_PLIES = 300  # longer games are adjudicated a draw
+
+# Short opening lines in UCI notation, every one is played once with each colour
+OPENINGS = [
+    "e2e4 e7e5 g1f3 b8c6 f1b5",  # Ruy Lopez
+    "e2e4 e7e5 g1f3 b8c6 f1c4",  # Italian
+    "e2e4 c7c5 g1f3 d7d6",  # Sicilian
+    "e2e4 c7c5 b1c3 b8c6",  # closed Sicilian
+    "e2e4 e7e6 d2d4 d7d5",  # French
+    "e2e4 c7c6 d2d4 d7d5",  # Caro-Kann
+    "e2e4 d7d5 e4d5 d8d5",  # Scandinavian
+    "e2e4 g8f6 e4e5 f6d5",  # Alekhine
+    "d2d4 d7d5 c2c4 e7e6",  # Queen's Gambit declined
+    "d2d4 d7d5 c2c4 d5c4",  # Queen's Gambit accepted
+    "d2d4 g8f6 c2c4 g7g6",  # King's Indian
+    "d2d4 g8f6 c2c4 e7e6 b1c3 f8b4",  # Nimzo-Indian
+    "d2d4 f7f5",  # Dutch
+    "c2c4 e7e5",  # English
+    "g1f3 d7d5 g2g3",  # Reti
+    "e2e4 e7e5 f2f4",  # King's Gambit
+]
+
+LIMIT_KEYS = {"time": "timeLimit", "nodes": "maxNodes", "depth": "maxDepth"}
+SEARCHER_KEYS = {"TT_SIZE": "ttSize", "SEARCH_STATS": "collectStats"}  # passed to the engine's Searcher
+# Chess_AI names the search reads while it runs. The others are default arguments or read by code the
+# match doesn't run (findBestMove), setting them would leave the engine unchanged.
+SEARCH_OVERRIDES = ("CHECK_EVERY", "ROOT_TIE_MARGIN", "HASH_MOVE_SCORE", "CAPTURE_SCORE")
+
+
+def parseValue(text):
+    if text == "None":
+        return None
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+
+def parseEngine(text, default_name):
+    """
+    Engine configuration from 'key=value,key=value', see the module comment
+    """
+    config = {"name": default_name, "timeLimit": None, "maxNodes": None, "maxDepth": Chess_AI.MAX_DEPTH,
+              "ttSize": Chess_AI.TT_SIZE, "collectStats": Chess_AI.SEARCH_STATS, "overrides": {}}
+    for item in text.split(","):
+        if not item.strip():
+            continue
+        if "=" not in item:
+            raise ValueError("expected key=value in engine configuration: " + item)
+        key, value = (part.strip() for part in item.split("=", 1))
+        if key == "name":
+            config["name"] = value
+        elif key in LIMIT_KEYS:
+            config[LIMIT_KEYS[key]] = parseValue(value)
+        elif key in SEARCHER_KEYS:
+            config[SEARCHER_KEYS[key]] = parseValue(value)
+        elif key in SEARCH_OVERRIDES:
+            config["overrides"][key] = parseValue(value)
+        elif key in ("TIME_LIMIT", "NODE_LIMIT", "MAX_DEPTH"):
+            raise ValueError("%s has no effect on the match, use time, nodes or depth" % key)
+        elif key.isupper() and hasattr(Chess_AI, key):
+            raise ValueError("%s is not read by the match's searches, it can be one of: %s" %
+                             (key, ", ".join(sorted(SEARCHER_KEYS) + list(SEARCH_OVERRIDES))))
+        else:
+            raise ValueError("unknown engine setting: " + key)
+    size = config["ttSize"]
+    if not isinstance(size, int) or size < 1 or size & (size - 1):
+        raise ValueError("TT_SIZE must be a power of two: %s" % size)
+    if config["timeLimit"] is None and config["maxNodes"] is None and config["maxDepth"] >= Chess_AI.MAX_DEPTH:
+        raise ValueError("engine %s has no time, node or depth limit" % config["name"])
+    return config
+
+
+def getSanNotation(gs, move, validMoves):
+    """
+    Standard algebraic notation of move, one of validMoves of gs, with + or # for check and mate
+    """
+    if move.isCastleMove:
+        san = "O-O" if move.endCol == 6 else "O-O-O"
+    else:
+        piece = move.pieceMoved[1]
+        end = move.getRankFile(move.endRow, move.endCol)
+        if piece == "P":
+            san = (move.colsToFiles[move.startCol] + "x" + end) if move.isCapture else end
+            if move.isPawnPromotion:
+                san += "=" + (move.promoteTo[1] if move.promoteTo else "Q")
+        else:
+            # other pieces of the same kind that can reach the same square
+            rivals = [other for other in validMoves if other.pieceMoved == move.pieceMoved and
+                      other.endRow == move.endRow and other.endCol == move.endCol and
+                      (other.startRow, other.startCol) != (move.startRow, move.startCol)]
+            qualifier = ""
+            if rivals:
+                if all(other.startCol != move.startCol for other in rivals):
+                    qualifier = move.colsToFiles[move.startCol]
+                elif all(other.startRow != move.startRow for other in rivals):
+                    qualifier = move.rowsToRanks[move.startRow]
+                else:
+                    qualifier = move.getRankFile(move.startRow, move.startCol)
+            san = piece + qualifier + ("x" if move.isCapture else "") + end
+    gs.makeMove(move)
+    replies = gs.getValidMoves()
+    if gs.inCheck:
+        san += "#" if len(replies) == 0 else "+"
+    gs.undoMove()
+    return san
+
+
+def isRepetition(gs):
+    """
+    True when the current position occurred twice before since the last capture or pawn move
+    """
+    return gs.repetitionCount() >= 3
+
+
+def isInsufficientMaterial(board):
+    """
+    Neither side can mate: bare kings, or a king and a single minor piece against a bare king
+    """
+    pieces = [square[1] for row in board for square in row if square != "--" and square[1] != "K"]
+    return len(pieces) == 0 or (len(pieces) == 1 and pieces[0] in "NB")
+
+
+def gameResult(gs, validMoves):
+    """
+    (PGN result, termination) once the game is over, else None
+    """
+    if len(validMoves) == 0:
+        if gs.inCheck:
+            return ("0-1" if gs.white_to_move else "1-0"), "checkmate"
+        return "1/2-1/2", "stalemate"
+    if gs.halfmove_clock >= 100:
+        return "1/2-1/2", "fifty-move rule"
+    if isRepetition(gs):
+        return "1/2-1/2", "threefold repetition"
+    if isInsufficientMaterial(gs.board):
+        return "1/2-1/2", "insufficient material"
+    return None
+
+
+searchers = {}  # engine name -> Searcher, per pool worker
+
+
+def initMatchWorker():
+    # with SEARCH_STATS on the search prints its statistics after every move, too much for hundreds of games
+    sys.stdout = open(os.devnull, "w")
+
+
+def searchMove(config, gs, validMoves):
+    """
+    Search with one engine configuration, its Chess_AI overrides are only set for the search
+    """
+    searcher = searchers[config["name"]]
+    saved = {name: getattr(Chess_AI, name) for name in config["overrides"]}
+    for name, value in config["overrides"].items():
+        setattr(Chess_AI, name, value)
+    try:
+        searcher.setLimits(config["timeLimit"], config["maxNodes"], config["maxDepth"])
+        return searcher.search(gs, validMoves)
+    finally:
+        for name, value in saved.items():
+            setattr(Chess_AI, name, value)
+
+
+def playGame(number, fen, opening, white, black, seed):
+    """
+    Play one game in a pool worker, returns a dict with the result, the SAN moves and nodes and time per colour
+    """
+    for config in (white, black):
+        if config["name"] not in searchers:
+            searchers[config["name"]] = Chess_AI.Searcher(ttSize=config["ttSize"],
+                                                          collectStats=bool(config["collectStats"]))
+        searchers[config["name"]].newGame()
+        searchers[config["name"]].random.seed(seed)
+    gs = Chess_engine.GameState.from_fen(fen)
+    sanMoves = []
+    for notation in opening:
+        validMoves = gs.getValidMoves()
+        move = next((move for move in validMoves if move.getUciNotation() == notation), None)
+        if move is None:
+            raise ValueError("illegal opening move %s in game %d" % (notation, number))
+        sanMoves.append(getSanNotation(gs, move, validMoves))
+        gs.makeMove(move)
+    nodes = {"white": 0, "black": 0}
+    seconds = {"white": 0.0, "black": 0.0}
+    result = None
+    while result is None:
+        validMoves = gs.getValidMoves()
+        result = gameResult(gs, validMoves)
+        if result is not None:
+            break
+        if len(sanMoves) >= MAX_PLIES:
+            result = "1/2-1/2", "adjudicated after %d plies" % MAX_PLIES
+            break
+        side = "white" if gs.white_to_move else "black"
+        config = white if gs.white_to_move else black
+        start = time.perf_counter()
+        move = searchMove(config, gs, validMoves[:])
+        seconds[side] += time.perf_counter() - start
+        nodes[side] += searchers[config["name"]].nodes + searchers[config["name"]].qnodes
+        sanMoves.append(getSanNotation(gs, move, validMoves))
+        gs.makeMove(move)
+    return {"number": number, "fen": fen, "white": white["name"], "black": black["name"],
+            "result": result[0], "termination": result[1], "moves": sanMoves,
+            "whiteToStart": fen.split()[1] == "w", "fullmove": int(fen.split()[5]) if len(fen.split()) > 5 else 1,
+            "nodes": nodes, "seconds": seconds}
+
+
+def playTask(task):
+    return playGame(*task)
+
+
+def formatPgn(game, event, date):
+    headers = [("Event", event), ("Site", "?"), ("Date", date), ("Round", str(game["number"])),
+               ("White", game["white"]), ("Black", game["black"]), ("Result", game["result"])]
+    if game["fen"] != START_FEN:
+        headers += [("SetUp", "1"), ("FEN", game["fen"])]
+    headers += [("PlyCount", str(len(game["moves"]))), ("Termination", game["termination"])]
+    text = "".join('[%s "%s"]\n' % header for header in headers) + "\n"
+    tokens = []
+    number = game["fullmove"]
+    whiteToMove = game["whiteToStart"]
+    for i, san in enumerate(game["moves"]):
+        if whiteToMove:
+            tokens.append("%d. %s" % (number, san))
+        elif i == 0:
+            tokens.append("%d... %s" % (number, san))
+        else:
+            tokens.append(san)
+        if not whiteToMove:
+            number += 1
+        whiteToMove = not whiteToMove
+    tokens.append(game["result"])
+    line = ""
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > 79:
+            text += line + "\n"
+            line = token
+        else:
+            line = line + " " + token if line else token
+    return text + line + "\n\n"
+
+
+def eloDifference(wins, draws, losses):
+    """
+    Elo difference implied by the score, with the half width of its 95% confidence interval.
+    Both are infinite when one side scored everything.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + 0.5 * draws) / games
+    if score <= 0 or score >= 1:
+        return (math.inf if score >= 1 else -math.inf), math.inf
+
+    def elo(p):
+        return -400 * math.log10(1 / p - 1) + 0.0  # no -0.0 for an even score
+
+    # standard error of the mean score per game
+    deviation = math.sqrt((wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games)
+    margin = 1.96 * deviation / math.sqrt(games)
+    low = max(score - margin, 1e-9)
+    high = min(score + margin, 1 - 1e-9)
+    return elo(score), (elo(high) - elo(low)) / 2
+
+
+def readOpenings(path):
+    """
+    (fen, [UCI moves]) for every position of an EPD file
+    """
+    return [(gs.to_fen(), []) for gs, _ in Chess_engine.readPositions(path)]
+
+
+def runMatch(engine1, engine2, games, workers, pgnPath, openings, out=sys.stdout):
+    """
+    Play the match and return (wins, draws, losses) from engine1's point of view
+    """
+    tasks = []
+    for number in range(1, games + 1):
+        fen, opening = openings[(number - 1) // 2 % len(openings)]
+        # every opening once with each colour
+        white, black = (engine1, engine2) if number % 2 == 1 else (engine2, engine1)
+        tasks.append((number, fen, opening, white, black, number))
+    wins = draws = losses = 0
+    nodes = {engine1["name"]: 0, engine2["name"]: 0}
+    seconds = {engine1["name"]: 0.0, engine2["name"]: 0.0}
+    date = time.strftime("%Y.%m.%d")
+    event = "%s vs %s" % (engine1["name"], engine2["name"])
+    start = time.time()
+    with Pool(workers, initializer=initMatchWorker) as pool, open(pgnPath, "w") as pgn:
+        for game in pool.imap_unordered(playTask, tasks, chunksize=1):
+            pgn.write(formatPgn(game, event, date))
+            pgn.flush()
+            for side in ("white", "black"):
+                nodes[game[side]] += game["nodes"][side]
+                seconds[game[side]] += game["seconds"][side]
+            if game["result"] == "1/2-1/2":
+                draws += 1
+            elif (game["result"] == "1-0") == (game["white"] == engine1["name"]):
+                wins += 1
+            else:
+                losses += 1
+            out.write("game %d: %s - %s %s (%s), %s: +%d =%d -%d\n" %
+                      (game["number"], game["white"], game["black"], game["result"], game["termination"],
+                       engine1["name"], wins, draws, losses))
+    elapsed = time.time() - start
+    elo, margin = eloDifference(wins, draws, losses)
+    out.write("\n%d games in %.1fs, %.1f games/hour with %d workers\n" % (games, elapsed, games * 3600 / elapsed, workers))
+    for engine in (engine1, engine2):
+        name = engine["name"]
+        out.write("%s: %.0f nodes/s\n" % (name, nodes[name] / seconds[name] if seconds[name] > 0 else 0))
+    out.write("%s vs %s: +%d =%d -%d, score %.1f%%, Elo %+.1f +/- %.1f (95%%)\n" %
+              (engine1["name"], engine2["name"], wins, draws, losses,
+               100 * (wins + 0.5 * draws) / games if games else 0, elo, margin))
+    return wins, draws, losses
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Self-play match between two engine configurations")
+    parser.add_argument("--engine1", default="nodes=20000", help="configuration of the first engine")
+    parser.add_argument("--engine2", default="nodes=20000", help="configuration of the second engine")
+    parser.add_argument("--games", type=int, default=2 * len(OPENINGS))
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="games played at the same time")
+    parser.add_argument("--pgn", default="match.pgn", help="file the games are written to")
+    parser.add_argument("--openings", help="EPD file of start positions instead of the bundled openings")
+    args = parser.parse_args(argv)
+    try:
+        engine1 = parseEngine(args.engine1, "engine1")
+        engine2 = parseEngine(args.engine2, "engine2")
+    except ValueError as error:
+        parser.error(str(error))
+    if engine1["name"] == engine2["name"]:
+        parser.error("the engines need different names")
+    if args.openings:
+        openings = readOpenings(args.openings)
+    else:
+        openings = [(START_FEN, line.split()) for line in OPENINGS]
+    runMatch(engine1, engine2, args.games, args.workers, args.pgn, openings)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
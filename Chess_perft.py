@@ -0,0 +1,148 @@
+# Headless perft tool for Chess_engine.GameState: counts the leaf nodes of the legal move tree to a given depth,
+# compares them with known results and reports nodes per second, to test and benchmark the move generator.
+#
+#   python Chess_perft.py                          run the bundled suite
+#   python Chess_perft.py --depth 4 --divide       per root move counts for the start position
+#   python Chess_perft.py --fen "<fen>" --depth 3 --backend bitboard
+#   python Chess_perft.py --epd perftsuite.epd     run the positions and counts of an EPD file
+#   python Chess_perft.py --verify                 same suite, checking the incremental state after every move
+
+import argparse
+import sys
+import time
+
+import Chess_engine
+
+START_FEN = Chess_engine.START_FEN
+
+# Standard perft positions (chessprogramming.org, "Perft Results") and their node counts for depth 1, 2, 3...
+PERFT_SUITE = [
+    ("start", START_FEN,
+     [20, 400, 8902, 197281, 4865609]),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     [48, 2039, 97862, 4085603]),
+    ("position 3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     [14, 191, 2812, 43238, 674624]),
+    ("position 4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 4 mirrored", "r2q1rk1/pP1p2pp/Q4n2/bbp1p3/Np6/1B3NBn/pPPP1PPP/R3K2R b KQ - 0 1",
+     [6, 264, 9467, 422333]),
+    ("position 5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     [44, 1486, 62379, 2103487]),
+    ("position 6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     [46, 2079, 89890, 3894594]),
+]
+
+
+def perft(gs, depth, bulk=True):
+    """
+    Number of leaf nodes of the legal move tree. With bulk the last ply is counted from the length
+    of the move list instead of playing every move.
+    """
+    if depth == 0:
+        return 1
+    moves = gs.getValidMoves()
+    if bulk and depth == 1:
+        return len(moves)
+    nodes = 0
+    for move in moves:
+        gs.makeMove(move)
+        nodes += perft(gs, depth - 1, bulk)
+        gs.undoMove()
+    return nodes
+
+
+def divide(gs, depth, bulk=True):
+    """
+    Perft of every root move, as a list of (move in UCI notation, nodes)
+    """
+    results = []
+    for move in gs.getValidMoves():
+        gs.makeMove(move)
+        results.append((move.getUciNotation(), perft(gs, depth - 1, bulk)))
+        gs.undoMove()
+    return results
+
+
+def timedPerft(gs, depth, bulk=True):
+    start = time.perf_counter()
+    nodes = perft(gs, depth, bulk)
+    elapsed = time.perf_counter() - start
+    return nodes, elapsed
+
+
+def readSuite(path, backend="mailbox"):
+    """
+    Suite entries from an EPD file in the usual perft format, e.g. '<fen> ;D1 20 ;D2 400'
+    """
+    for number, (gs, operations) in enumerate(Chess_engine.readPositions(path, backend), 1):
+        expected = []
+        while "D%d" % (len(expected) + 1) in operations:
+            expected.append(int(operations["D%d" % (len(expected) + 1)]))
+        yield operations.get("id", "%s:%d" % (path, number)), gs.to_fen(), expected
+
+
+def runSuite(backend="mailbox", max_nodes=100000, bulk=True, out=sys.stdout, suite=PERFT_SUITE):
+    """
+    Run every suite position to each depth whose expected count is at most max_nodes.
+    Returns the number of wrong counts.
+    """
+    failures = 0
+    total_nodes = 0
+    total_time = 0.0
+    for name, fen, expected in suite:
+        for depth, expected_nodes in enumerate(expected, 1):
+            if expected_nodes > max_nodes:
+                break
+            nodes, elapsed = timedPerft(Chess_engine.GameState.from_fen(fen, backend), depth, bulk)
+            total_nodes += nodes
+            total_time += elapsed
+            status = "ok" if nodes == expected_nodes else "FAIL, expected %d" % expected_nodes
+            if nodes != expected_nodes:
+                failures += 1
+            out.write("%-20s depth %d %10d nodes %8.2fs %10.0f nodes/s  %s\n" %
+                      (name, depth, nodes, elapsed, nodes / elapsed if elapsed > 0 else 0, status))
+    out.write("total %d nodes in %.2fs, %.0f nodes/s, %d failed\n" %
+              (total_nodes, total_time, total_nodes / total_time if total_time > 0 else 0, failures))
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Perft and divide for Chess_engine.GameState")
+    parser.add_argument("--fen", help="position to count, the bundled suite is run when neither --fen nor --depth is given")
+    parser.add_argument("--epd", help="run the suite from an EPD file with ;D1 ;D2 ... counts instead of the bundled one")
+    parser.add_argument("--depth", type=int, help="depth to count to")
+    parser.add_argument("--divide", action="store_true", help="print the count of every root move")
+    parser.add_argument("--backend", choices=("mailbox", "bitboard"), default="mailbox")
+    parser.add_argument("--no-bulk", action="store_true", help="play the moves of the last ply instead of counting them")
+    parser.add_argument("--max-nodes", type=int, default=100000, help="largest expected count the suite runs")
+    parser.add_argument("--verify", action="store_true",
+                        help="recompute the Zobrist key, evaluation and piece squares after every make and undo "
+                             "and check the undo records (Chess_engine VERIFY_* flags), implies --no-bulk")
+    args = parser.parse_args(argv)
+    bulk = not args.no_bulk and not args.verify
+    if args.verify:
+        Chess_engine.VERIFY_ZOBRIST = Chess_engine.VERIFY_EVAL = Chess_engine.VERIFY_PIECE_SQUARES = True
+        Chess_engine.VERIFY_UNDO_STACK = True
+
+    if args.fen is None and args.depth is None:
+        suite = readSuite(args.epd, args.backend) if args.epd else PERFT_SUITE
+        return 1 if runSuite(args.backend, args.max_nodes, bulk, suite=suite) else 0
+
+    gs = Chess_engine.GameState.from_fen(args.fen or START_FEN, args.backend)
+    depth = args.depth if args.depth is not None else 3
+    start = time.perf_counter()
+    if args.divide:
+        results = divide(gs, depth, bulk)
+        for notation, nodes in results:
+            print("%s: %d" % (notation, nodes))
+        nodes = sum(count for _, count in results)
+    else:
+        nodes = perft(gs, depth, bulk)
+    elapsed = time.perf_counter() - start
+    print("\nnodes %d, time %.2fs, %.0f nodes/s" % (nodes, elapsed, nodes / elapsed if elapsed > 0 else 0))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
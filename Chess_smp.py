@@ -0,0 +1,277 @@
+# Parallel searches.
+#
+# Lazy SMP: the main process and threads - 1 helper processes all search the same root position.
+# They share one transposition table in shared memory, so each process cuts off on the results of
+# the others. Helpers start at different depths and with different root move orders so they don't
+# all search the same tree in lockstep. The move of the deepest completed iteration is played.
+#
+# Root split: every iteration hands the root moves out to a persistent ProcessPoolExecutor, one task
+# per move, and the workers raise a shared alpha as they finish. The best move and score are the same
+# as those of Chess_AI.searchBestMove at the same depth, only the node counts differ.
+
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool, RawArray, Value
+
+import Chess_engine, Chess_AI
+
+THREADS = 1  # processes per search, main process included
+
+pool = None
+poolThreads = 0
+sharedWords = None
+sharedTable = None
+stopId = None
+searchId = 0
+helperSearcher = None  # Searcher of a helper process
+
+
+def initHelper(words, stop, seed):
+    """
+    Pool initializer: give every helper process a Searcher on the shared transposition table
+    """
+    global stopId, helperSearcher
+    helperSearcher = Chess_AI.Searcher(seed=seed)
+    helperSearcher.transpositionTable = Chess_AI.SharedTranspositionTable(words)
+    stopId = stop
+
+
+def helperSearch(fen, helper, myId, timeLimit, maxNodes, maxDepth):
+    """
+    Search run by a helper process, returns (completed depth, score, best move in UCI notation)
+    """
+    helperSearcher.random.seed(helper * 7919 + myId)
+    gs = Chess_engine.GameState.from_fen(fen)
+    helperSearcher.setLimits(timeLimit, maxNodes, maxDepth)
+    bestMove = helperSearcher.search(gs, gs.getValidMoves(), stop=lambda: stopId.value >= myId, startDepth=1 + helper % 2)
+    return (helperSearcher.lastCompletedDepth, helperSearcher.lastScore,
+            bestMove.getUciNotation() if bestMove is not None else None)
+
+
+def startPool(threads):
+    """
+    Start (or restart with another size) the helper pool and the shared table
+    """
+    global pool, poolThreads, sharedWords, sharedTable, stopId
+    if pool is not None and poolThreads == threads:
+        return
+    stopPool()
+    sharedWords = RawArray("Q", 2 * Chess_AI.TT_SIZE + 2)
+    sharedTable = Chess_AI.SharedTranspositionTable(sharedWords)
+    stopId = Value("i", searchId, lock=False)
+    pool = Pool(threads - 1, initializer=initHelper, initargs=(sharedWords, stopId, threads))
+    poolThreads = threads
+
+
+def stopPool():
+    global pool, poolThreads
+    if pool is not None:
+        pool.terminate()
+        pool.join()
+        pool = None
+        poolThreads = 0
+
+
+def searchParallel(gs, validMoves, threads=THREADS, timeLimit=Chess_AI.TIME_LIMIT, maxNodes=Chess_AI.NODE_LIMIT,
+                   maxDepth=Chess_AI.MAX_DEPTH, stop=None, searcher=None):
+    """
+    Lazy SMP search with threads processes, returns the best move like Searcher.search.
+    The calling process searches with searcher, Chess_AI.defaultSearcher if None.
+    """
+    global searchId
+    searcher = searcher if searcher is not None else Chess_AI.defaultSearcher
+    searcher.setLimits(timeLimit, maxNodes, maxDepth)
+    if threads <= 1:
+        return searcher.search(gs, validMoves, stop)
+    startPool(threads)
+    searchId += 1
+    myId = searchId
+    sharedTable.nextGeneration()  # before the helpers start, so every process reads the same generation
+    fen = gs.to_fen()
+    helpers = [pool.apply_async(helperSearch, (fen, helper, myId, timeLimit, maxNodes, maxDepth))
+               for helper in range(1, threads)]
+    ownTable = searcher.transpositionTable
+    searcher.transpositionTable = sharedTable
+    try:
+        bestMove = searcher.search(gs, validMoves, stop)
+    finally:
+        searcher.transpositionTable = ownTable
+        stopId.value = myId  # the main search is done, the helpers stop at their next clock check
+    for result in helpers:
+        depth, score, notation = result.get()
+        if depth > searcher.lastCompletedDepth and notation is not None:
+            for move in validMoves:
+                if move.getUciNotation() == notation:
+                    searcher.bestMove, searcher.lastCompletedDepth, searcher.lastScore = move, depth, score
+                    searcher.bestLine = [move]
+                    bestMove = move
+                    break
+    return bestMove
+
+
+executor = None
+executorWorkers = 0
+splitAlpha = None
+splitStopId = None
+splitSearchId = 0
+splitPosition = None  # (fen, GameState) of the last position a worker was given
+workerSearchId = 0  # search the tables of a worker were last reset for
+splitSearcher = None  # Searcher of a pool worker
+
+
+def initSplitWorker(alpha, stop):
+    global splitAlpha, splitStopId, splitSearcher
+    splitAlpha = alpha
+    splitStopId = stop
+    splitSearcher = Chess_AI.Searcher(exactRoot=True)
+
+
+def searchRootMove(fen, notation, index, depth, myId, deadline):
+    """
+    Search one root move to depth in a pool worker with the shared alpha as lower bound.
+    Returns (index, score, nodes, qnodes), the score is None if the search was stopped.
+    """
+    global splitPosition, workerSearchId
+    if splitPosition is None or splitPosition[0] != fen:
+        splitPosition = (fen, Chess_engine.GameState.from_fen(fen))
+    gs = splitPosition[1]
+    searcher = splitSearcher
+    if workerSearchId != myId:  # first task of a new search in this worker
+        workerSearchId = myId
+        searcher.transpositionTable.newSearch()
+        searcher.resetMoveOrdering()
+        searcher.stopRequested = lambda: splitStopId.value >= myId
+    searcher.growKillerMoves(depth)
+    searcher.rootDepth = depth
+    searcher.deadline = deadline
+    searcher.nodeLimit = None
+    searcher.nodes = 0
+    searcher.qnodes = 0
+    turnMultiplier = 1 if gs.white_to_move else -1
+    startPly = len(gs.move_log)
+    if not playRootMove(gs, notation):
+        raise ValueError("illegal root move " + notation)
+    alpha = splitAlpha.value
+    try:
+        nextMoves = gs.getValidMoves() if depth > 1 else None
+        score = -searcher.findMoveNegaMaxAlphaBeta(gs, nextMoves, depth - 1, -Chess_AI.CHECKMATE,
+                                                   -(alpha - Chess_AI.ROOT_TIE_MARGIN), -turnMultiplier)
+    except Chess_AI.SearchTimeout:
+        score = None
+    while len(gs.move_log) > startPly:
+        gs.undoMove()
+    if score is not None:
+        with splitAlpha.get_lock():
+            if score > splitAlpha.value:
+                splitAlpha.value = score
+    return index, score, searcher.nodes, searcher.qnodes
+
+
+def playRootMove(gs, notation):
+    for move in gs.getValidMoves():
+        if move.getUciNotation() == notation:
+            gs.makeMove(move)
+            return True
+    return False
+
+
+def startExecutor(workers):
+    global executor, executorWorkers, splitAlpha, splitStopId
+    if executor is not None and executorWorkers == workers:
+        return
+    stopExecutor()
+    splitAlpha = Value("d", -Chess_AI.CHECKMATE)
+    splitStopId = Value("i", splitSearchId, lock=False)
+    executor = ProcessPoolExecutor(workers, initializer=initSplitWorker, initargs=(splitAlpha, splitStopId))
+    executorWorkers = workers
+
+
+def stopExecutor():
+    global executor, executorWorkers
+    if executor is not None:
+        executor.shutdown(cancel_futures=True)
+        executor = None
+        executorWorkers = 0
+
+
+def searchSplitRoot(gs, validMoves, workers, timeLimit=Chess_AI.TIME_LIMIT, maxNodes=Chess_AI.NODE_LIMIT,
+                    maxDepth=Chess_AI.MAX_DEPTH, stop=None, searcher=None):
+    """
+    Iterative deepening with the root moves of every iteration split over workers processes.
+    The node limit is checked between iterations. Returns the best move like Searcher.search
+    and leaves the result on searcher, Chess_AI.defaultSearcher if None. The result is the one
+    of a single-process search with Searcher exactRoot on.
+    """
+    global splitSearchId
+    searcher = searcher if searcher is not None else Chess_AI.defaultSearcher
+    if workers <= 1:
+        searcher.setLimits(timeLimit, maxNodes, maxDepth)
+        return searcher.search(gs, validMoves, stop)
+    startExecutor(workers)
+    splitSearchId += 1
+    myId = splitSearchId
+    if searcher.shuffle:
+        searcher.random.shuffle(validMoves)  # same shuffle as Searcher.search, ties go to the earlier move of this list
+    fen = gs.to_fen()
+    notations = [move.getUciNotation() for move in validMoves]
+    deadline = time.time() + timeLimit if timeLimit is not None else None
+    stats = Chess_AI.SearchStats()
+    start = time.perf_counter()
+    bestMove = None
+    bestScore = 0
+    completedDepth = 0
+    totalNodes = 0
+    totalQnodes = 0
+    order = list(range(len(validMoves)))
+    for depth in range(1, maxDepth + 1):
+        splitAlpha.value = -Chess_AI.CHECKMATE
+        iterationStart = time.perf_counter()
+        # the best move of the last iteration alone first so the others start with a good alpha
+        first = executor.submit(searchRootMove, fen, notations[order[0]], order[0], depth, myId,
+                                deadline if depth > 1 else None)
+        results = [first.result()]
+        if results[0][1] is not None:
+            futures = [executor.submit(searchRootMove, fen, notations[i], i, depth, myId, deadline if depth > 1 else None)
+                       for i in order[1:]]
+            for future in futures:
+                if stop is not None and stop():
+                    splitStopId.value = myId
+                results.append(future.result())
+        totalNodes += sum(result[2] for result in results)
+        totalQnodes += sum(result[3] for result in results)
+        if any(result[1] is None for result in results):
+            break
+        # lowest index among the best scores, as the single-process root does
+        results.sort()
+        iterationBest = None
+        iterationScore = -Chess_AI.CHECKMATE
+        for index, score, _, _ in results:
+            if score > iterationScore:
+                iterationBest, iterationScore = index, score
+        if iterationBest is None:  # every move runs into mate, any of them will do
+            bestMove = validMoves[order[0]] if len(validMoves) > 0 else None
+            break
+        bestMove = validMoves[iterationBest]
+        bestScore = iterationScore
+        completedDepth = depth
+        stats.iterations.append((depth, time.perf_counter() - iterationStart,
+                                 sum(result[2] + result[3] for result in results)))
+        if len(validMoves) == 1 or iterationScore >= Chess_AI.CHECKMATE:
+            break
+        if (maxNodes is not None and totalNodes + totalQnodes >= maxNodes) or (stop is not None and stop()):
+            break
+        order.remove(iterationBest)
+        order.insert(0, iterationBest)
+    splitStopId.value = myId
+    stats.seconds = time.perf_counter() - start
+    stats.depth = completedDepth
+    stats.nodes = totalNodes
+    stats.qnodes = totalQnodes
+    searcher.stats = stats
+    if searcher.collectStats:
+        print("%s\nover %d workers" % (stats, workers))
+    searcher.bestMove = bestMove
+    searcher.lastCompletedDepth = completedDepth
+    searcher.lastScore = bestScore
+    searcher.bestLine = [bestMove] if bestMove is not None else []
+    return bestMove
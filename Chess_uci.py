@@ -0,0 +1,245 @@
+# Console front end speaking the UCI protocol over stdin/stdout, so the engine can run under tournament
+# managers (cutechess-cli, Arena...) or in a container without a display. Imports no GUI module.
+#
+#   python Chess_uci.py
+#
+# Supported: uci, isready, setoption (Threads, Ponder), ucinewgame, position [startpos | fen <fen>] [moves ...],
+# go [wtime btime winc binc movestogo movetime depth nodes infinite ponder], stop, ponderhit, quit.
+# The search runs in a thread, so stop and isready are answered while it thinks.
+
+import sys
+import threading
+import time
+
+import Chess_engine, Chess_AI, Chess_smp, Chess_worker
+
+ENGINE_NAME = "ChessBotAI"
+ENGINE_AUTHOR = "stepToBecomeGigachad"
+MOVES_TO_GO = 30  # moves the remaining time is split over when the GUI doesn't say
+MOVE_OVERHEAD = 0.05  # seconds kept back per move for the GUI and the pipes
+MAX_THREADS = 64
+
+
+def timeForMove(params, whiteToMove):
+    """
+    Seconds to spend on this move from the go parameters, None when only depth, nodes or stop end the search
+    """
+    if "movetime" in params:
+        return max(0.01, params["movetime"] / 1000 - MOVE_OVERHEAD)
+    left = params.get("wtime" if whiteToMove else "btime")
+    if left is None:
+        return None
+    increment = params.get("winc" if whiteToMove else "binc", 0)
+    movesToGo = params.get("movestogo", MOVES_TO_GO)
+    budget = left / max(1, movesToGo) + 0.8 * increment
+    # never more than half of what is left on the clock
+    return max(0.01, min(budget, left / 2) / 1000 - MOVE_OVERHEAD)
+
+
+def formatScore(score, line):
+    """
+    UCI score of a search result for the side to move: centipawns, or mate in moves along the line
+    """
+    if score >= Chess_AI.CHECKMATE:
+        return "mate %d" % ((len(line) + 1) // 2)
+    if score <= -Chess_AI.CHECKMATE:
+        return "mate -%d" % (len(line) // 2)
+    return "cp %d" % round(score * 100)
+
+
+class UciEngine():
+    """
+    State of the UCI session: the current position, the Searcher and the search thread
+    """
+    def __init__(self, out=sys.stdout):
+        self.out = out
+        self.outLock = threading.Lock()  # info lines come from the search thread
+        self.gs = Chess_engine.GameState()
+        self.searcher = Chess_AI.Searcher()
+        self.threads = 1
+        self.thread = None
+        self.stopEvent = threading.Event()
+        self.pondering = False
+        self.ponderTimeLimit = None
+        self.ponderMaxNodes = None
+        self.ponderDeadline = None  # set by ponderhit
+        self.ponderNodeLimit = None  # node count of the search the ponderhit node budget ends at
+        self.searchStart = 0.0
+
+    def send(self, line):
+        with self.outLock:
+            self.out.write(line + "\n")
+            self.out.flush()
+
+    def handle(self, line):
+        """
+        Apply one command line, returns False on quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command = tokens[0]
+        if command == "uci":
+            self.send("id name " + ENGINE_NAME)
+            self.send("id author " + ENGINE_AUTHOR)
+            self.send("option name Threads type spin default 1 min 1 max %d" % MAX_THREADS)
+            self.send("option name Ponder type check default false")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.setOption(tokens[1:])
+        elif command == "ucinewgame":
+            self.waitSearch()
+            self.searcher.newGame()
+            if Chess_smp.sharedTable is not None:
+                Chess_smp.sharedTable.clear()
+            self.gs = Chess_engine.GameState()
+        elif command == "position":
+            self.waitSearch()
+            self.setPosition(tokens[1:])
+        elif command == "go":
+            self.waitSearch()
+            self.go(tokens[1:])
+        elif command == "stop":
+            self.stopEvent.set()
+        elif command == "ponderhit":
+            if self.pondering:
+                # the clock runs from now on, with the limits the go ponder command gave
+                self.pondering = False
+                self.ponderDeadline = time.time() + self.ponderTimeLimit if self.ponderTimeLimit is not None else None
+                if self.ponderMaxNodes is not None:
+                    self.ponderNodeLimit = self.searcher.nodes + self.searcher.qnodes + self.ponderMaxNodes
+        elif command == "quit":
+            self.waitSearch()
+            Chess_smp.stopPool()
+            return False
+        return True
+
+    def setOption(self, tokens):
+        if "name" not in tokens:
+            return
+        valueAt = tokens.index("value") if "value" in tokens else len(tokens)
+        name = " ".join(tokens[tokens.index("name") + 1:valueAt]).lower()
+        value = " ".join(tokens[valueAt + 1:])
+        if name == "threads":
+            try:
+                self.threads = max(1, min(MAX_THREADS, int(value)))
+                if self.threads > 1:
+                    # here and not in the search thread: a child forked while the main thread holds
+                    # the stdin lock in its read would hang when multiprocessing closes stdin
+                    Chess_smp.startPool(self.threads)
+            except ValueError:
+                self.send("info string bad Threads value " + value)
+
+    def setPosition(self, tokens):
+        if not tokens:
+            return
+        movesAt = tokens.index("moves") if "moves" in tokens else len(tokens)
+        if tokens[0] == "startpos":
+            fen = Chess_engine.START_FEN
+        elif tokens[0] == "fen":
+            fen = " ".join(tokens[1:movesAt])
+        else:
+            return
+        try:
+            gs = Chess_engine.GameState.from_fen(fen)
+        except ValueError as error:
+            self.send("info string bad fen: %s" % error)
+            return
+        for notation in tokens[movesAt + 1:]:
+            if not Chess_worker.playUciMove(gs, notation):
+                self.send("info string illegal move " + notation)
+                break
+        self.gs = gs
+
+    def go(self, tokens):
+        params = {}
+        flags = set()
+        i = 0
+        while i < len(tokens):
+            if tokens[i] in ("infinite", "ponder"):
+                flags.add(tokens[i])
+                i += 1
+            elif i + 1 < len(tokens):
+                try:
+                    params[tokens[i]] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+                i += 2
+            else:
+                i += 1
+        timeLimit = None if "infinite" in flags else timeForMove(params, self.gs.white_to_move)
+        maxNodes = params.get("nodes")
+        maxDepth = min(params.get("depth", Chess_AI.MAX_DEPTH), Chess_AI.MAX_DEPTH)
+        self.pondering = "ponder" in flags
+        self.ponderTimeLimit = timeLimit
+        self.ponderMaxNodes = maxNodes
+        self.ponderDeadline = None
+        self.ponderNodeLimit = None
+        if self.pondering:
+            timeLimit = maxNodes = None  # limits start with ponderhit
+        self.stopEvent.clear()
+        self.searchStart = time.time()
+        self.thread = threading.Thread(target=self.runSearch, args=(timeLimit, maxNodes, maxDepth, "infinite" in flags),
+                                       daemon=True)
+        self.thread.start()
+
+    def stopRequested(self):
+        if self.stopEvent.is_set():
+            return True
+        if self.ponderNodeLimit is not None and self.searcher.nodes + self.searcher.qnodes >= self.ponderNodeLimit:
+            return True
+        return self.ponderDeadline is not None and time.time() >= self.ponderDeadline
+
+    def reportIteration(self, searcher):
+        elapsed = time.time() - self.searchStart
+        nodes = searcher.nodes + searcher.qnodes
+        self.send("info depth %d score %s nodes %d nps %d time %d pv %s" %
+                  (searcher.lastCompletedDepth, formatScore(searcher.lastScore, searcher.bestLine), nodes,
+                   nodes / elapsed if elapsed > 0 else 0, elapsed * 1000,
+                   " ".join(move.getUciNotation() for move in searcher.bestLine)))
+
+    def runSearch(self, timeLimit, maxNodes, maxDepth, infinite):
+        validMoves = self.gs.getValidMoves()
+        bestMove = None
+        if len(validMoves) > 0:
+            self.searcher.onIteration = self.reportIteration
+            bestMove = Chess_smp.searchParallel(self.gs, validMoves, self.threads, timeLimit, maxNodes, maxDepth,
+                                                stop=self.stopRequested, searcher=self.searcher)
+        # UCI wants no bestmove before stop (or ponderhit) in these modes, even if the search is over
+        while (infinite or self.pondering) and not self.stopEvent.is_set():
+            self.stopEvent.wait(0.01)
+        if bestMove is None:
+            self.send("bestmove 0000")
+        elif len(self.searcher.bestLine) > 1:
+            self.send("bestmove %s ponder %s" % (bestMove.getUciNotation(), self.searcher.bestLine[1].getUciNotation()))
+        else:
+            self.send("bestmove " + bestMove.getUciNotation())
+
+    def waitSearch(self):
+        """
+        Stop the running search, if any, and wait for its bestmove
+        """
+        if self.thread is not None:
+            self.stopEvent.set()
+            self.thread.join()
+            self.thread = None
+
+
+def main():
+    out = sys.stdout
+    # with SEARCH_STATS on the search prints its statistics, keep them off the protocol channel
+    sys.stdout = sys.stderr
+    engine = UciEngine(out)
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    else:
+        engine.waitSearch()
+        Chess_smp.stopPool()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,223 @@
+# Long-lived AI process. The GUI sends it small commands (new game, position as a FEN plus the moves played,
+# go, stop) instead of starting a new Process and pickling the whole GameState for every move,
+# and the transposition table stays warm from one move to the next.
+#
+# Pondering: after its move the engine keeps searching the position after the reply it expects.
+# If the opponent plays that move the running search becomes the real one, with the time spent
+# pondering counted towards the move; otherwise it is stopped and a normal search starts.
+
+import time
+from multiprocessing import Process, Queue, Value
+from queue import Empty
+
+import Chess_engine, Chess_AI, Chess_smp
+
+
+def playUciMove(gs, notation):
+    """
+    Play the legal move with the given UCI notation, returns False if there is none
+    """
+    for move in gs.getValidMoves():
+        if move.getUciNotation() == notation:
+            gs.makeMove(move)
+            return True
+    return False
+
+
+def progressReporter(results, searchId):
+    """
+    Searcher.onIteration callback that sends the result of every completed iteration to the GUI
+    """
+    def report(searcher):
+        results.put(("info", searchId, {"depth": searcher.lastCompletedDepth,
+                                         "move": searcher.bestMove.getUciNotation(),
+                                         "score": searcher.lastScore,  # for the side to move
+                                         "nodes": searcher.nodes + searcher.qnodes,
+                                         "line": [move.getUciNotation() for move in searcher.bestLine]}))
+    return report
+
+
+def engineLoop(commands, results, stopId, ponderDeadline, threads=1):
+    """
+    Body of the worker process: keeps one GameState and applies commands until "quit"
+    """
+    gs = Chess_engine.GameState()
+    fen = Chess_engine.START_FEN
+    played = []  # UCI notation of the moves played on gs since fen
+    searcher = Chess_AI.Searcher()
+    while True:
+        command = commands.get()
+        name = command[0]
+        if name == "quit":
+            Chess_smp.stopPool()
+            break
+        elif name == "newgame":
+            searcher.newGame()
+            if Chess_smp.sharedTable is not None:
+                Chess_smp.sharedTable.clear()
+            gs = Chess_engine.GameState()
+            fen = Chess_engine.START_FEN
+            played = []
+        elif name == "position":
+            new_fen, moves = command[1], command[2]
+            if new_fen != fen:
+                gs = Chess_engine.GameState.from_fen(new_fen)
+                fen = new_fen
+                played = []
+            # only undo and replay the moves that differ from the ones already on the board
+            common = 0
+            while common < len(played) and common < len(moves) and played[common] == moves[common]:
+                common += 1
+            while len(played) > common:
+                gs.undoMove()
+                played.pop()
+            for notation in moves[common:]:
+                if not playUciMove(gs, notation):
+                    results.put(("error", "illegal move " + notation))
+                    break
+                played.append(notation)
+        elif name == "go":
+            searchId, timeLimit, maxNodes, maxDepth, ponder = command[1:]
+            validMoves = gs.getValidMoves()
+            searcher.onIteration = progressReporter(results, searchId)
+            if ponder:
+                # no limits until the ponder hit sets a deadline
+                def stop():
+                    return stopId.value >= searchId or 0 < ponderDeadline.value <= time.time()
+                timeLimit = maxNodes = None
+            else:
+                def stop():
+                    return stopId.value >= searchId
+            bestMove = Chess_smp.searchParallel(gs, validMoves, threads, timeLimit, maxNodes, maxDepth,
+                                                stop=stop, searcher=searcher)
+            results.put(("bestmove", searchId, bestMove.getUciNotation() if bestMove is not None else None,
+                         searcher.stats))
+
+
+class EngineWorker():
+    """
+    Handle on the worker process. Searches run in the background: go() starts one and poll() returns its move
+    in UCI notation once it is done. While it runs, poll() keeps progress up to date with the last completed
+    iteration. With threads > 1 every search is a Lazy SMP search (see Chess_smp).
+    """
+    def __init__(self, threads=Chess_smp.THREADS):
+        self.commands = Queue()
+        self.results = Queue()
+        self.stopId = Value("i", 0)  # every search with an id up to this one should stop
+        self.searchId = 0
+        self.thinking = False
+        self.progress = None  # depth, move, score, nodes and line of the last iteration the current search completed
+        self.lastStats = None  # Chess_AI.SearchStats of the search poll() last returned a move for
+        self.ponderDeadline = Value("d", 0.0)  # end of the current ponder search, 0 while the opponent is thinking
+        self.pondering = False
+        self.ponderMoves = None  # moves of the position being pondered, the expected reply included
+        self.ponderStart = 0.0
+        self.ponderTimeLimit = None
+        self.ponderResult = None  # move of a ponder search that ended before the opponent moved
+        self.ponderHits = 0
+        self.ponderMisses = 0
+        # a daemon process may not start the helper processes of a parallel search
+        self.process = Process(target=engineLoop, args=(self.commands, self.results, self.stopId, self.ponderDeadline,
+                                                        threads),
+                               daemon=threads <= 1)
+        self.process.start()
+
+    def newGame(self):
+        self.stop()
+        self.commands.put(("newgame",))
+
+    def setPosition(self, fen, moves):
+        self.commands.put(("position", fen, list(moves)))
+
+    def go(self, timeLimit=Chess_AI.TIME_LIMIT, maxNodes=Chess_AI.NODE_LIMIT, maxDepth=Chess_AI.MAX_DEPTH, ponder=False):
+        self.searchId += 1
+        self.thinking = True
+        self.progress = None
+        self.commands.put(("go", self.searchId, timeLimit, maxNodes, maxDepth, ponder))
+
+    def startSearch(self, fen, moves, timeLimit=Chess_AI.TIME_LIMIT):
+        """
+        Search the position after moves. A ponder search of the same position carries on instead.
+        """
+        moves = list(moves)
+        if self.pondering and moves == self.ponderMoves:
+            self.ponderHits += 1
+            self.pondering = False
+            # the time spent pondering counts towards this move
+            self.ponderDeadline.value = self.ponderStart + timeLimit if timeLimit is not None else 0.0
+            return
+        if self.pondering:
+            self.ponderMisses += 1
+        self.stop()
+        self.setPosition(fen, moves)
+        self.go(timeLimit)
+
+    def startPonder(self, fen, moves, timeLimit=Chess_AI.TIME_LIMIT):
+        """
+        After the engine's own move: search the position after the reply its last search expected, if any
+        """
+        if self.progress is None or len(self.progress["line"]) < 2 or not moves or \
+                self.progress["line"][0] != moves[-1]:
+            return
+        self.ponderMoves = list(moves) + [self.progress["line"][1]]
+        self.ponderDeadline.value = 0.0
+        self.ponderStart = time.time()
+        self.ponderTimeLimit = timeLimit
+        self.ponderResult = None
+        self.setPosition(fen, self.ponderMoves)
+        self.go(ponder=True)
+        self.pondering = True
+
+    def ponderHitRate(self):
+        return self.ponderHits / (self.ponderHits + self.ponderMisses) if self.ponderHits + self.ponderMisses else 0.0
+
+    def stop(self):
+        """
+        Stop the current search, its result is thrown away
+        """
+        if self.thinking:
+            self.stopId.value = self.searchId
+            self.thinking = False
+        self.pondering = False
+        self.ponderResult = None
+
+    def moveNow(self):
+        """
+        Stop the current search early, poll() then returns the best move of its last completed iteration
+        """
+        if self.thinking:
+            self.stopId.value = self.searchId
+
+    def poll(self):
+        """
+        (True, move in UCI notation or None) once the current search has finished, else (False, None)
+        """
+        if self.ponderResult is not None and not self.pondering:
+            notation, self.lastStats = self.ponderResult
+            self.ponderResult = None
+            self.thinking = False
+            return True, notation
+        while self.thinking:
+            try:
+                message = self.results.get_nowait()
+            except Empty:
+                break
+            if message[0] == "info" and message[1] == self.searchId:
+                self.progress = message[2]
+            elif message[0] == "bestmove" and message[1] == self.searchId:
+                if self.pondering:  # finished before the opponent moved, kept until the ponder hit
+                    self.ponderResult = (message[2], message[3])
+                    continue
+                self.thinking = False
+                self.lastStats = message[3]
+                return True, message[2]
+            elif message[0] == "error":
+                print(message[1])
+        return False, None
+
+    def quit(self):
+        self.stop()
+        self.commands.put(("quit",))
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()